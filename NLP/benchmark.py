@@ -0,0 +1,931 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the NLP service
+
+Usage:
+    python benchmark.py concurrency --concurrency 32 --requests 2000 --pool-size 1 2 4
+    python benchmark.py fastpath
+    python benchmark.py scaling --clauses 1 10 50 100 250 500
+    python benchmark.py modes --mode full rules
+    python benchmark.py append --records 10000 1000000
+    python benchmark.py training --mode legacy minibatch
+    python benchmark.py conversion --records 100000 1000000 --workers 1 4
+    python benchmark.py training-memory --docs 100000 1000000
+    python benchmark.py logging --sample-rate 0.01 1
+    python benchmark.py workers --workers 4 --launcher uvicorn prefork
+    python benchmark.py suite --output results.json --baseline baseline.json --threshold 0.25
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+train_data_path = os.path.join(current_dir, "train_data.json")
+
+
+def load_prompts(path=train_data_path):
+    """Load the prompts from train_data.json"""
+    with open(path, "r") as f:
+        return [item["prompt"] for item in json.load(f)]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+    return samples[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(1000 * sum(samples) / len(samples), 3) if samples else None,
+        "p50_ms": round(1000 * percentile(samples, 50), 3) if samples else None,
+        "p95_ms": round(1000 * percentile(samples, 95), 3) if samples else None,
+        "p99_ms": round(1000 * percentile(samples, 99), 3) if samples else None,
+    }
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (Linux)"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_server(session, url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url + "/ready") as response:
+                if response.status == 200:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+async def drive_load(url, prompts, concurrency, total):
+    """Fire `total` /process_prompt requests with `concurrency` in flight, probing / alongside"""
+    import aiohttp
+
+    latencies = []
+    probe_latencies = []
+    errors = 0
+    next_index = 0
+
+    async with aiohttp.ClientSession() as session:
+        await wait_for_server(session, url)
+
+        async def worker():
+            nonlocal next_index, errors
+            while next_index < total:
+                prompt = prompts[next_index % len(prompts)]
+                next_index += 1
+                start = time.perf_counter()
+                async with session.post(url + "/process_prompt", json={"prompt": prompt}) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        async def probe(done):
+            # A cheap endpoint served while inference is running shows whether the loop is blocked
+            while not done.is_set():
+                start = time.perf_counter()
+                async with session.get(url + "/") as response:
+                    await response.read()
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        done = asyncio.Event()
+        probe_task = asyncio.create_task(probe(done))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+        batching = None
+        async with session.get(url + "/batching_stats") as response:
+            if response.status == 200:
+                batching = await response.json()
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "process_prompt": summarize(latencies),
+        "home_probe": summarize(probe_latencies),
+        "batching": batching,
+    }
+
+
+def run_concurrency(args):
+    prompts = load_prompts()
+    results = []
+    if args.url:
+        results.append(asyncio.run(drive_load(args.url.rstrip("/"), prompts, args.concurrency, args.requests)))
+    else:
+        for pool_size in args.pool_size:
+            port = free_port()
+            env = dict(os.environ, NLP_POOL_SIZE=str(pool_size))
+            # Measure the pipeline rather than the result caches and fast path unless asked
+            env.setdefault("NLP_CACHE_SIZE", "0")
+            env.setdefault("NLP_SKELETON_CACHE_SIZE", "0")
+            env.setdefault("NLP_FAST_PATH", "0")
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "nlp_service:app", "--port", str(port), "--log-level", "warning"],
+                cwd=current_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                result = asyncio.run(drive_load(f"http://127.0.0.1:{port}", prompts, args.concurrency, args.requests))
+            finally:
+                server.terminate()
+                server.wait()
+            result["pool_size"] = pool_size
+            results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+def canonical_prompts():
+    """Every combination of the canonical grammar over a few values per slot"""
+    address = "0x90889C14149Bf930B6824789431B8479aaB8e5ee"
+    networks = ["", " on Base", " on Ethereum mainnet", " on Optimism TESTNET"]
+    amounts = ["", "5 ", "0.0025 "]
+    tokens = ["ETH", "USDC"]
+    prompts = []
+    for verb, amount, token, dest, network in itertools.product(
+            ["Send", "transfer", "MOVE"], amounts, tokens, ["Bob", address, "Cant", "eth"], networks):
+        prompts.append(f"{verb} {amount}{token} to {dest}{network}")
+    for verb, amount, token, token2, network in itertools.product(["swap", "Swap"], amounts, tokens, tokens, networks):
+        prompts.append(f"{verb} {amount}{token} for {token2}{network}")
+    for verb, amount, token, prep, source, dest in itertools.product(
+            ["Bridge", "execute bridge"], amounts, tokens, ["from", "on"],
+            ["Base", "Optimism mainnet"], ["Ethereum", "Base testnet"]):
+        prompts.append(f"{verb} {amount}{token} {prep} {source} to {dest}")
+    for verb, query_type, token, who, network in itertools.product(
+            ["check", "Get", "QUERY", "show"], ["balance", "Amount"], ["", " of ETH"],
+            ["", " for Alice", " for " + address, " for Dont"], networks):
+        prompts.append(f"{verb} {query_type}{token}{who}{network}")
+    return prompts
+
+
+def run_fastpath(args):
+    logging.disable(logging.INFO)
+    sys.path.insert(0, current_dir)
+    import nlp_service
+    from fast_parser import FastParser
+
+    fast_parser = FastParser(nlp_service.nlp.tokenizer.rules)
+    report = {}
+    mismatches = []
+    for name, prompts in (("train_data", load_prompts()), ("canonical", canonical_prompts())):
+        hits = 0
+        fast_time = pipeline_time = 0.0
+        for prompt in prompts:
+            prompt = nlp_service.normalize_prompt(prompt)
+            start = time.perf_counter()
+            fast = fast_parser.parse(prompt)
+            fast_time += time.perf_counter() - start
+            if fast is None:
+                continue
+            hits += 1
+            start = time.perf_counter()
+            full = nlp_service.parse_prompt(nlp_service.nlp, prompt)
+            pipeline_time += time.perf_counter() - start
+            if fast != full:
+                mismatches.append({"prompt": prompt, "fast_path": fast, "pipeline": full})
+        report[name] = {
+            "prompts": len(prompts),
+            "fast_path_hits": hits,
+            "hit_ratio": round(hits / len(prompts), 4),
+            "fast_path_mean_us": round(1e6 * fast_time / len(prompts), 2),
+            "pipeline_mean_us_on_hits": round(1e6 * pipeline_time / hits, 2) if hits else None,
+        }
+    report["mismatches"] = mismatches
+    print(json.dumps(report, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+
+CLAUSES = [
+    "send {n} ETH to Alice on Base",
+    "swap {n} USDC for ETH on Optimism",
+    "bridge {n} ETH from Base to Ethereum",
+    "check balance of USDC for Bob",
+]
+
+
+def multi_clause_prompt(clauses, separator=", then "):
+    """A pasted prompt of the form "send X to A, then swap Y ..., then bridge Z ..." with `clauses` clauses"""
+    parts = [CLAUSES[i % len(CLAUSES)].format(n=i + 1) for i in range(clauses)]
+    return separator.join(parts)
+
+
+def run_scaling(args):
+    logging.disable(logging.INFO)
+    sys.path.insert(0, current_dir)
+    import nlp_service
+
+    nlp = nlp_service.nlp
+    component = nlp.get_pipe("intent_parameters")
+    results = []
+    for clauses, separator in itertools.product(args.clauses, args.separator):
+        prompt = multi_clause_prompt(clauses, separator)
+        doc = nlp(prompt)
+        pipeline_samples = []
+        component_samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            doc = nlp(prompt)
+            pipeline_samples.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            component(doc)
+            component_samples.append(time.perf_counter() - start)
+        results.append({
+            "clauses": clauses,
+            "separator": separator,
+            "tokens": len(doc),
+            "sentences": len(list(doc.sents)),
+            "intent_count": doc._.parameters.get("intent_count", 1 if doc._.intent else 0),
+            "pipeline": summarize(pipeline_samples),
+            "intent_parameters": summarize(component_samples),
+        })
+    print(json.dumps(results, indent=2))
+
+
+def run_pipeline_stats(args):
+    """Load the service pipeline in this process and report load time, latency, RSS and an output digest"""
+    logging.disable(logging.INFO)
+    sys.path.insert(0, current_dir)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    import nlp_service
+    load_s = time.perf_counter() - start
+
+    nlp = nlp_service.nlp
+    prompts = load_prompts()
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        digest.update(json.dumps(nlp_service.parse_prompt(nlp, prompt), sort_keys=True).encode())
+    samples = []
+    for _ in range(args.repeat):
+        for prompt in prompts:
+            start = time.perf_counter()
+            nlp(prompt)
+            samples.append(time.perf_counter() - start)
+    print(json.dumps({
+        "mode": nlp_service.SERVING_MODE,
+        "pipeline": nlp.pipe_names,
+        "import_and_load_s": round(load_s, 3),
+        "rss_before_import_mb": rss_before,
+        "rss_mb": rss_mb(),
+        "latency": summarize(samples),
+        "output_sha256": digest.hexdigest(),
+    }))
+
+
+def run_modes(args):
+    results = []
+    for mode in args.mode:
+        env = dict(os.environ, NLP_SERVING_MODE=mode, NLP_POOL_SIZE="1")
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "pipeline-stats", "--repeat", str(args.repeat)],
+            cwd=current_dir, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+    if len({result["output_sha256"] for result in results}) > 1:
+        print("Serving modes produced different results", file=sys.stderr)
+        sys.exit(1)
+
+
+def legacy_append(path, record):
+    """The read-modify-write of train_data.json that /log_prompt used to do"""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = []
+    data.append(record)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def run_append(args):
+    sys.path.insert(0, current_dir)
+    from training_store import TrainingLog, compact, encode
+
+    template = {"prompt": "Send 0.5 ETH to 0x90889C14149Bf930B6824789431B8479aaB8e5ee on Base",
+                "entities": [{"start": 5, "end": 8, "label": "AMOUNT"}], "intent": "Transfer"}
+    results = []
+    workdir = tempfile.mkdtemp(prefix="nlp-append-")
+    try:
+        for records in args.records:
+            existing = [dict(template, prompt=f"{template['prompt']} #{i}") for i in range(records)]
+
+            log = TrainingLog(os.path.join(workdir, "train_data.jsonl"))
+            with open(log.path, "wb") as f:
+                f.write(encode(existing))
+            samples = []
+            for i in range(args.appends):
+                start = time.perf_counter()
+                log.append(template)
+                samples.append(time.perf_counter() - start)
+            result = {"records": records, "jsonl_append": summarize(samples)}
+
+            dataset_path = os.path.join(workdir, "train_data.json")
+            start = time.perf_counter()
+            compact(log, dataset_path)
+            result["compact_s"] = round(time.perf_counter() - start, 3)
+
+            if records <= args.legacy_max:
+                with open(dataset_path, "w") as f:
+                    json.dump(existing, f, indent=2)
+                samples = []
+                for i in range(args.legacy_appends):
+                    start = time.perf_counter()
+                    legacy_append(dataset_path, template)
+                    samples.append(time.perf_counter() - start)
+                result["legacy_read_modify_write"] = summarize(samples)
+            results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+    print(json.dumps(results, indent=2))
+
+
+def run_training(args):
+    results = []
+    workdir = tempfile.mkdtemp(prefix="nlp-training-")
+    try:
+        for mode in args.mode:
+            output = subprocess.run(
+                [sys.executable, os.path.join(current_dir, "train_model.py"), "--mode", mode,
+                 "--output-dir", os.path.join(workdir, mode)],
+                cwd=current_dir, capture_output=True, text=True, check=True,
+            ).stdout
+            report = output.strip().splitlines()[-1]
+            results.append(json.loads(report[len("Training report: "):]))
+    finally:
+        shutil.rmtree(workdir)
+    print(json.dumps(results, indent=2))
+
+
+def synthetic_records(count, offset=0):
+    """Distinct annotated records in the train_data.json format"""
+    for i in range(offset, offset + count):
+        amount = f"{i}.5"
+        prompt = f"Send {amount} ETH to Bob on Base"
+        yield {"prompt": prompt, "intent": "Transfer", "entities": [
+            {"start": 0, "end": 4, "label": "INTENT"},
+            {"start": 5, "end": 5 + len(amount), "label": "AMOUNT"},
+            {"start": 6 + len(amount), "end": 9 + len(amount), "label": "TOKEN"},
+        ]}
+
+
+def write_records(path, count):
+    """Write count synthetic records as a train_data.json array without holding them in memory"""
+    with open(path, "w") as f:
+        f.write("[\n")
+        for i, record in enumerate(synthetic_records(count)):
+            f.write((",\n" if i else "") + json.dumps(record))
+        f.write("\n]\n")
+
+
+def peak_rss_mb(who=None):
+    import resource
+    return round(resource.getrusage(who or resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_conversion_step(args):
+    import resource
+    sys.path.insert(0, current_dir)
+    from corpus import ShardedCorpus
+    from train_model import convert_to_spacy
+
+    start = time.perf_counter()
+    if args.legacy:
+        convert_to_spacy(args.input, os.path.join(args.shards, "train.spacy"))
+        result = {}
+    else:
+        result = ShardedCorpus(args.shards, workers=args.workers).update(args.input)
+        result["new_shards"] = len(result["new_shards"])
+    result["time_s"] = round(time.perf_counter() - start, 3)
+    result["peak_rss_mb"] = peak_rss_mb()
+    if args.workers > 1 and not args.legacy:
+        result["worker_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    print(json.dumps(result))
+
+
+def conversion_step(input_path, shards, workers=1, legacy=False):
+    os.makedirs(shards, exist_ok=True)
+    command = [sys.executable, os.path.abspath(__file__), "conversion-step", "--input", input_path,
+               "--shards", shards, "--workers", str(workers)]
+    output = subprocess.run(command + (["--legacy"] if legacy else []), cwd=current_dir,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_conversion(args):
+    results = []
+    workdir = tempfile.mkdtemp(prefix="nlp-conversion-")
+    try:
+        for count in args.records:
+            input_path = os.path.join(workdir, "train_data.json")
+            write_records(input_path, count)
+            result = {"records": count}
+            if count <= args.legacy_max:
+                result["full_rebuild"] = conversion_step(input_path, os.path.join(workdir, "legacy"), legacy=True)
+            for workers in args.workers:
+                shards = os.path.join(workdir, f"shards-{count}-{workers}")
+                result[f"sharded_{workers}_workers"] = conversion_step(input_path, shards, workers)
+            write_records(input_path, count + args.added)
+            result["incremental"] = conversion_step(input_path, shards, args.workers[-1])
+            results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+    print(json.dumps(results, indent=2))
+
+
+def vocabulary_records(count):
+    """Annotated transfer prompts drawn from a fixed vocabulary of 1000 amounts and 1000 names"""
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "bu"]
+    for i in range(count):
+        amount = f"{i % 1000}.5"
+        name = "".join(syllables[int(d)] for d in f"{i // 1000 % 1000:03d}").capitalize()
+        prompt = f"Send {amount} ETH to {name}"
+        yield {"prompt": prompt, "intent": "Transfer", "entities": [
+            {"start": 0, "end": 4, "label": "INTENT"},
+            {"start": 5, "end": 5 + len(amount), "label": "AMOUNT"},
+            {"start": 6 + len(amount), "end": 9 + len(amount), "label": "TOKEN"},
+            {"start": 13 + len(amount), "end": len(prompt), "label": "RECIPIENT"},
+        ]}
+
+
+def run_training_memory_step(args):
+    sys.path.insert(0, current_dir)
+    from corpus import ShardedCorpus
+    from train_model import make_examples, make_nlp, training_examples
+    from spacy.util import minibatch
+
+    corpus = ShardedCorpus(args.shards)
+    nlp = make_nlp()
+    optimizer = nlp.initialize(lambda: make_examples(nlp, itertools.islice(corpus.docs(nlp.vocab), 1000)))
+    start = time.perf_counter()
+    epoch = training_examples(nlp, corpus, cache_limit=args.cache_limit)
+    rss_before = rss_mb()
+    docs = 0
+    for batch in minibatch(epoch(), size=32):
+        nlp.update(batch, drop=0.2, sgd=optimizer)
+        docs += len(batch)
+    print(json.dumps({
+        "docs": docs,
+        "examples": "cached" if len(corpus) <= args.cache_limit else "streamed",
+        "epoch_s": round(time.perf_counter() - start, 1),
+        "rss_before_epoch_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def run_training_memory(args):
+    results = []
+    workdir = tempfile.mkdtemp(prefix="nlp-training-memory-")
+    try:
+        for count in args.docs:
+            input_path = os.path.join(workdir, "train_data.jsonl")
+            with open(input_path, "w") as f:
+                for record in vocabulary_records(count):
+                    f.write(json.dumps(record) + "\n")
+            shards = os.path.join(workdir, f"shards-{count}")
+            conversion_step(input_path, shards, os.cpu_count())
+            for cache_limit in ([0, count] if count <= args.cached_max else [0]):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "training-memory-step", "--shards", shards,
+                     "--cache-limit", str(cache_limit)],
+                    cwd=current_dir, capture_output=True, text=True, check=True,
+                ).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(workdir)
+    print(json.dumps(results, indent=2))
+
+
+def run_logging(args):
+    """Time spent logging one /process_prompt request on the request path, before and after queued logging"""
+    logging.disable(logging.INFO)
+    sys.path.insert(0, current_dir)
+    import nlp_service
+    from structured_log import setup_logging
+    logging.disable(logging.NOTSET)
+
+    nlp = nlp_service.nlp
+    pairs = [(prompt, nlp_service.parse_prompt(nlp, prompt)) for prompt in load_prompts()]
+    start = time.perf_counter()
+    for prompt, _ in pairs:
+        nlp_service.parse_prompt(nlp, prompt)
+    parse_us = 1e6 * (time.perf_counter() - start) / len(pairs)
+    logger = logging.getLogger("nlp_service")
+    root = logging.getLogger()
+
+    def legacy(prompt, result, started):
+        logger.info("Processing prompt: %s", prompt)
+        logger.info("Processed prompt result: %s", json.dumps(result, indent=2))
+
+    def sampled(rate):
+        def log(prompt, result, started):
+            if random.random() < rate:
+                logger.info("Processed prompt", extra={"fields": {
+                    "endpoint": "/process_prompt", "ms": round(1000 * (time.perf_counter() - started), 3),
+                    "prompt": prompt, "result": result}})
+        return log
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="nlp-logging-") as workdir:
+        variants = [("blocking_indented_json", None, legacy)]
+        variants += [(f"queued_sample_{rate:g}", rate, sampled(rate)) for rate in args.sample_rate]
+        for name, rate, log in variants:
+            path = os.path.join(workdir, name + ".log")
+            stream = open(path, "w")
+            random.seed(0)
+            if rate is None:
+                for handler in list(root.handlers):
+                    root.removeHandler(handler)
+                handler = logging.StreamHandler(stream)
+                root.addHandler(handler)
+            else:
+                handler = setup_logging("INFO", "json", stream=stream)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                for prompt, result in pairs:
+                    log(prompt, result, time.perf_counter())
+            caller_s = time.perf_counter() - start
+            if rate is not None:
+                while handler.queue.qsize():
+                    time.sleep(0.001)
+            drained_s = time.perf_counter() - start
+            requests = args.repeat * len(pairs)
+            stream.flush()
+            results.append({
+                "variant": name,
+                "requests": requests,
+                "request_path_us": round(1e6 * caller_s / requests, 2),
+                "request_path_share_of_parse": round(caller_s / requests * 1e6 / parse_us, 4),
+                "until_written_us": round(1e6 * drained_s / requests, 2),
+                "bytes_per_request": round(os.path.getsize(path) / requests, 1),
+                "dropped": getattr(handler, "dropped", 0),
+            })
+            stream.close()
+    print(json.dumps({"parse_prompt_us": round(parse_us, 1), "results": results}, indent=2))
+
+
+def process_tree(pid):
+    """pid and all of its descendants (Linux)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+async def wait_for_workers(url, workers, timeout=300):
+    """Seconds until `workers` distinct processes have answered /health warmed up"""
+    import aiohttp
+
+    start = time.perf_counter()
+    warmed_up = set()
+    # A new connection per request, several at once, so the kernel hands them to different workers
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+        async def probe():
+            try:
+                async with session.get(url + "/health") as response:
+                    health = await response.json()
+                    if health.get("warmed_up"):
+                        warmed_up.add(health["pid"])
+            except Exception:
+                await asyncio.sleep(0.05)
+
+        while len(warmed_up) < workers:
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"Only {len(warmed_up)} of {workers} workers came up within {timeout}s")
+            await asyncio.gather(*(probe() for _ in range(2 * workers)))
+    return time.perf_counter() - start
+
+
+def run_workers(args):
+    """Cold start time, memory and throughput of N workers started by uvicorn --workers vs serve.py"""
+    from serve import process_memory
+
+    prompts = load_prompts()
+    results = []
+    for launcher in args.launcher:
+        port = free_port()
+        if launcher == "uvicorn":
+            command = [sys.executable, "-m", "uvicorn", "nlp_service:app", "--workers", str(args.workers)]
+        else:
+            command = [sys.executable, "serve.py", "--workers", str(args.workers), "--memory-report-interval", "0"]
+        env = dict(os.environ, NLP_POOL_SIZE=str(args.pool_size))
+        start = time.perf_counter()
+        server = subprocess.Popen(command + ["--port", str(port), "--log-level", "warning"],
+                                  cwd=current_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            asyncio.run(wait_for_workers(url, args.workers))
+            ready_s = time.perf_counter() - start
+            load = asyncio.run(drive_load(url, prompts, args.concurrency, args.requests))
+            processes = [(pid, process_memory(pid)) for pid in process_tree(server.pid)]
+            processes = [(pid, memory) for pid, memory in processes if memory is not None]
+        finally:
+            server.terminate()
+            server.wait()
+        # The launcher's own process (and uvicorn's multiprocessing helpers) are not workers
+        worker_memory = [memory for pid, memory in processes if pid != server.pid and memory["rss_mb"] > 50]
+        results.append({
+            "launcher": launcher,
+            "workers": args.workers,
+            "pool_size": args.pool_size,
+            "all_workers_ready_s": round(ready_s, 2),
+            "processes": len(processes),
+            "total_rss_mb": round(sum(memory["rss_mb"] for _, memory in processes), 1),
+            "total_pss_mb": round(sum(memory["pss_mb"] for _, memory in processes), 1),
+            "worker_unique_mb": [memory["unique_mb"] for memory in worker_memory],
+            "worker_shared_mb": [memory["shared_mb"] for memory in worker_memory],
+            "throughput_rps": load["throughput_rps"],
+            "process_prompt": load["process_prompt"],
+        })
+    print(json.dumps(results, indent=2))
+
+
+def suite_prompts(seed=0, multi_intent=200, long=20):
+    """The prompt sets of the suite: train_data.json plus generated multi-intent and long pasted prompts"""
+    rng = random.Random(seed)
+    separators = [", then ", " and ", ". Then "]
+    return {
+        "train_data": load_prompts(),
+        "multi_intent": [multi_clause_prompt(rng.randint(2, 4), rng.choice(separators)) for _ in range(multi_intent)],
+        "long": [multi_clause_prompt(rng.randint(20, 80), rng.choice(separators)) for _ in range(long)],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=current_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def throughput(fn, docs, repeat):
+    """Median docs/sec of repeat timed calls to fn()"""
+    rates = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        rates.append(docs / (time.perf_counter() - start))
+    rates.sort()
+    return round(rates[len(rates) // 2], 1)
+
+
+def run_suite(args):
+    """Time the service pipeline on each prompt set, one prompt at a time and through nlp.pipe"""
+    import gc
+    # One replica: the suite measures the pipeline, not the pool
+    os.environ.setdefault("NLP_POOL_SIZE", "1")
+    logging.disable(logging.INFO)
+    sys.path.insert(0, current_dir)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    import nlp_service
+    import spacy
+    load_s = time.perf_counter() - start
+
+    nlp = nlp_service.nlp
+    batch_size = args.batch_size or nlp_service.DEFAULT_BATCH_SIZE
+    sets = {}
+    for name, prompts in suite_prompts(args.seed).items():
+        for prompt in prompts[:args.warmup]:
+            nlp_service.parse_prompt(nlp, prompt)
+        digest = hashlib.sha256()
+        for result in nlp_service.process_batch(nlp, prompts, batch_size):
+            digest.update(json.dumps(result, sort_keys=True).encode())
+
+        # Each prompt's latency is the median of its repeats, which keeps one noisy pass out of the tail
+        gc.collect()
+        samples = [[] for _ in prompts]
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for prompt, prompt_samples in zip(prompts, samples):
+                prompt_start = time.perf_counter()
+                nlp_service.parse_prompt(nlp, prompt)
+                prompt_samples.append(time.perf_counter() - prompt_start)
+        single_s = time.perf_counter() - start
+        gc.collect()
+        sets[name] = {
+            "prompts": len(prompts),
+            "mean_chars": round(sum(map(len, prompts)) / len(prompts), 1),
+            "latency": summarize([sorted(s)[len(s) // 2] for s in samples]),
+            "single_docs_per_s": round(len(prompts) * args.repeat / single_s, 1),
+            "pipe_docs_per_s": throughput(lambda: nlp_service.process_batch(nlp, prompts, batch_size),
+                                          len(prompts), args.repeat),
+            "output_sha256": digest.hexdigest(),
+        }
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "spacy": spacy.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "serving_mode": nlp_service.SERVING_MODE,
+            "pipeline": nlp.pipe_names,
+            "model": nlp_service.model_id,
+            "batch_size": batch_size,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "import_and_load_s": round(load_s, 3),
+        "memory": {"rss_before_import_mb": rss_before, "rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()},
+        "sets": sets,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_suite(baseline, results, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def compare_suite(baseline, results, threshold):
+    """Describe every metric that is more than threshold (a fraction) worse than in baseline"""
+    regressions = []
+
+    def check(name, before, after, higher_is_better=False):
+        if before is None or after is None or before == 0:
+            return
+        change = (after - before) / before
+        if (-change if higher_is_better else change) > threshold:
+            regressions.append(f"{name} {before} -> {after} ({change:+.1%})")
+
+    if baseline.get("environment") != results["environment"] or baseline.get("config") != results["config"]:
+        print("Warning: baseline was run with a different environment or configuration", file=sys.stderr)
+    for name, result in results["sets"].items():
+        before = baseline.get("sets", {}).get(name)
+        if before is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            check(f"{name}.latency.{key}", before["latency"][key], result["latency"][key])
+        for key in ("single_docs_per_s", "pipe_docs_per_s"):
+            check(f"{name}.{key}", before[key], result[key], higher_is_better=True)
+        if before["output_sha256"] != result["output_sha256"]:
+            print(f"Note: {name} results differ from the baseline", file=sys.stderr)
+    check("memory.peak_rss_mb", baseline.get("memory", {}).get("peak_rss_mb"), results["memory"]["peak_rss_mb"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="p50/p99 latency of /process_prompt under parallel load")
+    concurrency.add_argument("--url", help="Benchmark an already running service instead of starting one")
+    concurrency.add_argument("--concurrency", type=int, default=32, help="Requests in flight at once")
+    concurrency.add_argument("--requests", type=int, default=2000, help="Total requests to send")
+    concurrency.add_argument("--pool-size", type=int, nargs="+", default=[1, 2, 4],
+                             help="NLP_POOL_SIZE values to start the service with")
+    concurrency.set_defaults(func=run_concurrency)
+
+    fastpath = subparsers.add_parser("fastpath", help="Fast path hit ratio and parity with the pipeline (exits 1 on mismatch)")
+    fastpath.set_defaults(func=run_fastpath)
+
+    scaling = subparsers.add_parser("scaling", help="Latency of long multi-clause prompts by clause count")
+    scaling.add_argument("--clauses", type=int, nargs="+", default=[1, 10, 50, 100, 250, 500])
+    scaling.add_argument("--separator", nargs="+", default=[", then ", ". Then "],
+                         help="Clause separators; \". Then \" puts every clause in its own sentence")
+    scaling.add_argument("--repeat", type=int, default=5, help="Timed runs per clause count")
+    scaling.set_defaults(func=run_scaling)
+
+    modes = subparsers.add_parser("modes", help="Latency, RSS and output parity of the serving modes (exits 1 if outputs differ)")
+    modes.add_argument("--mode", nargs="+", default=["full", "rules"], help="NLP_SERVING_MODE values to compare")
+    modes.add_argument("--repeat", type=int, default=5, help="Timed passes over train_data.json")
+    modes.set_defaults(func=run_modes)
+
+    append = subparsers.add_parser("append", help="Cost of logging one training record at various dataset sizes")
+    append.add_argument("--records", type=int, nargs="+", default=[10000, 1000000], help="Records already stored")
+    append.add_argument("--appends", type=int, default=1000, help="Timed appends to the JSONL log")
+    append.add_argument("--legacy-appends", type=int, default=5, help="Timed read-modify-write appends to train_data.json")
+    append.add_argument("--legacy-max", type=int, default=1000000, help="Skip the legacy comparison above this size")
+    append.set_defaults(func=run_append)
+
+    training = subparsers.add_parser("training", help="Wall-clock training time and dev F-score of the training modes")
+    training.add_argument("--mode", nargs="+", default=["legacy", "minibatch"], help="train_model.py --mode values to compare")
+    training.set_defaults(func=run_training)
+
+    conversion = subparsers.add_parser("conversion", help="Full DocBin rebuild vs incremental shard conversion")
+    conversion.add_argument("--records", type=int, nargs="+", default=[100000, 1000000], help="Dataset sizes")
+    conversion.add_argument("--added", type=int, default=100, help="Records added before the incremental conversion")
+    conversion.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()], help="Conversion processes")
+    conversion.add_argument("--legacy-max", type=int, default=1000000, help="Skip the full rebuild above this size")
+    conversion.set_defaults(func=run_conversion)
+
+    conversion_step = subparsers.add_parser("conversion-step", help="One conversion, reporting time and peak RSS")
+    conversion_step.add_argument("--input", required=True)
+    conversion_step.add_argument("--shards", required=True)
+    conversion_step.add_argument("--workers", type=int, default=1)
+    conversion_step.add_argument("--legacy", action="store_true", help="Rebuild a single train.spacy with convert_to_spacy")
+    conversion_step.set_defaults(func=run_conversion_step)
+
+    training_memory = subparsers.add_parser("training-memory", help="Peak RSS of one training epoch, streamed vs cached")
+    training_memory.add_argument("--docs", type=int, nargs="+", default=[100000, 1000000], help="Corpus sizes")
+    training_memory.add_argument("--cached-max", type=int, default=100000,
+                                 help="Largest corpus to also train with every Example held in memory")
+    training_memory.set_defaults(func=run_training_memory)
+
+    training_memory_step = subparsers.add_parser("training-memory-step", help="One training epoch over a shard directory")
+    training_memory_step.add_argument("--shards", required=True)
+    training_memory_step.add_argument("--cache-limit", type=int, default=0)
+    training_memory_step.set_defaults(func=run_training_memory_step)
+
+    logging_parser = subparsers.add_parser("logging", help="Cost of request logging on the request path")
+    logging_parser.add_argument("--sample-rate", type=float, nargs="+", default=[0.01, 1.0],
+                                help="NLP_LOG_SAMPLE_RATE values to compare with the old per-request logging")
+    logging_parser.add_argument("--repeat", type=int, default=20, help="Passes over train_data.json")
+    logging_parser.set_defaults(func=run_logging)
+
+    workers = subparsers.add_parser("workers", help="Startup time, memory and throughput of uvicorn --workers vs "
+                                                    "the preforking serve.py")
+    workers.add_argument("--launcher", nargs="+", choices=["uvicorn", "prefork"], default=["uvicorn", "prefork"])
+    workers.add_argument("--workers", type=int, default=4, help="Worker processes")
+    workers.add_argument("--pool-size", type=int, default=1, help="NLP_POOL_SIZE of each worker")
+    workers.add_argument("--concurrency", type=int, default=16, help="Requests in flight at once")
+    workers.add_argument("--requests", type=int, default=1000, help="Requests to send once every worker is up")
+    workers.set_defaults(func=run_workers)
+
+    suite = subparsers.add_parser("suite", help="Latency, docs/sec and memory of the service pipeline on fixed prompt sets "
+                                               "(exits 1 on regressions against --baseline)")
+    suite.add_argument("--repeat", type=int, default=5, help="Timed passes over each prompt set")
+    suite.add_argument("--warmup", type=int, default=20, help="Untimed prompts per set before timing")
+    suite.add_argument("--batch-size", type=int, help="nlp.pipe batch size (default: NLP_BATCH_SIZE)")
+    suite.add_argument("--seed", type=int, default=0, help="Seed for the generated prompts")
+    suite.add_argument("--output", help="Write the results to this JSON file")
+    suite.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    suite.add_argument("--threshold", type=float, default=0.25,
+                       help="Fraction by which a latency, throughput or memory figure may worsen before failing")
+    suite.set_defaults(func=run_suite)
+
+    pipeline_stats = subparsers.add_parser("pipeline-stats", help="Stats for the pipeline as configured by the environment")
+    pipeline_stats.add_argument("--repeat", type=int, default=5, help="Timed passes over train_data.json")
+    pipeline_stats.set_defaults(func=run_pipeline_stats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
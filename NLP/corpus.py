@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Incremental, parallel conversion of train_data.json into DocBin shards
+
+Every record is identified by a hash of its content, and every shard has a
+list of the hashes of its docs, so a conversion only tokenizes records whose
+hash is not in a shard yet: its cost follows the number of added or edited
+records, not the size of the dataset. The input is streamed,
+new records are cut into shards of a fixed size and the shards are converted by
+a pool of worker processes. Shards that are mostly made of records no longer in
+the dataset are rewritten or deleted. At load time the shards are merged into
+one doc per record of the current dataset, optionally shuffled through a
+bounded buffer so training can stream a corpus of any size.
+
+Entities whose character offsets do not fall on token boundaries cannot be
+stored and are dropped; the number dropped is logged and kept per shard in
+manifest.json.
+
+Usage:
+    python corpus.py convert                          # update train_shards/ from train_data.json
+    python corpus.py convert --input train_data.jsonl --shards other_shards/ --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import spacy
+from spacy.tokens import DocBin
+
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_PATH = os.path.join(current_dir, "train_data.json")
+DEFAULT_SHARD_DIR = os.path.join(current_dir, "train_shards")
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+DEFAULT_SHARD_SIZE = 10000
+
+# A shard is rebuilt from the dataset once fewer than this fraction of its docs are still used
+MIN_LIVE_FRACTION = 0.5
+
+
+def record_hash(record):
+    data = json.dumps(record, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def iter_records(path, chunk_size=1 << 20):
+    """Yield the records of a JSON array (train_data.json) or JSON Lines file without reading it whole"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, pos = "", 0
+        array = None
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                buffer, pos = f.read(chunk_size), 0
+                if not buffer:
+                    return
+                continue
+            if array is None:
+                array = buffer[pos] == "["
+                pos += array
+                continue
+            if array and buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield record
+            pos = end
+
+
+def make_doc(nlp, record):
+    """Tokenize a train_data.json record and set its entities.
+
+    Returns (doc, dropped): spans that do not align to tokens are left out and counted.
+    """
+    doc = nlp.make_doc(record["prompt"])
+    ents = []
+    for ent in record["entities"]:
+        span = doc.char_span(ent["start"], ent["end"], label=ent["label"])
+        if span is not None:  # Only add valid spans
+            ents.append(span)
+    doc.ents = ents
+    return doc, len(record["entities"]) - len(ents)
+
+
+def convert_shard(path, records):
+    """Write records to a DocBin at path; returns (entities, misaligned entities)"""
+    # A fresh pipeline per shard: a vocab kept across shards would grow with every new token seen
+    nlp = spacy.blank("en")
+    db = DocBin()
+    entities = misaligned = 0
+    for record in records:
+        doc, dropped = make_doc(nlp, record)
+        db.add(doc)
+        entities += len(record["entities"])
+        misaligned += dropped
+    db.to_disk(path)
+    return entities, misaligned
+
+
+class ShardedCorpus:
+    """Training docs stored as DocBin shards plus a manifest of content hashes.
+
+    Next to every shard, a .hashes file lists the hash of each of its docs in
+    DocBin order. Each hash is stored in exactly one shard, however many times
+    the record occurs in the dataset. manifest.json keeps, per shard, the
+    number of docs and of entities dropped because they did not align to
+    tokens, plus the number of times each stored hash occurs in the dataset
+    where that is not once: 0 for records that have since been removed or
+    edited, more for duplicates. Reading the shards back therefore never
+    needs memory proportional to the dataset.
+    """
+
+    def __init__(self, path=DEFAULT_SHARD_DIR, shard_size=DEFAULT_SHARD_SIZE, workers=None):
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST_NAME)
+        self.shard_size = shard_size
+        self.workers = workers or os.cpu_count() or 1
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            # Start over from a missing or older manifest; update() deletes its shards
+            manifest = {"version": MANIFEST_VERSION, "records": 0, "next_shard": 0, "shards": {}, "counts": {}}
+        return manifest
+
+    def save_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(manifest))
+        os.replace(tmp_path, self.manifest_path)
+
+    def remove_unlisted(self, manifest):
+        """Delete shard files manifest does not list: those of an older manifest or an interrupted update"""
+        removed = 0
+        for filename in os.listdir(self.path):
+            name = filename[:-len(".hashes")] if filename.endswith(".hashes") else filename
+            if name.endswith(".spacy") and name not in manifest["shards"]:
+                os.remove(os.path.join(self.path, filename))
+                removed += 1
+        if removed:
+            logger.info("Deleted %d shard files not listed in %s", removed, self.manifest_path)
+
+    def shard_hashes(self, name):
+        with open(os.path.join(self.path, name + ".hashes"), "r") as f:
+            return f.read().split()
+
+    def records(self, source):
+        return iter_records(source) if isinstance(source, str) else iter(source)
+
+    def update(self, source):
+        """Bring the shards in line with source, converting only records that are not stored yet.
+
+        source is a path to a JSON array or JSON Lines file, or a list of
+        records. It is read once, plus a second time if a stale shard has to
+        be rebuilt.
+        """
+        started = time.perf_counter()
+        os.makedirs(self.path, exist_ok=True)
+        manifest = self.load_manifest()
+        self.remove_unlisted(manifest)
+        shards = {name: self.shard_hashes(name) for name in manifest["shards"]}
+        stored = {h for shard_hashes in shards.values() for h in shard_hashes}
+        counts = Counter()
+
+        with ShardWriter(self, manifest) as writer:
+            for record in self.records(source):
+                h = record_hash(record)
+                counts[h] += 1
+                if h not in stored and h not in writer.pending:
+                    writer.add(h, record)
+
+            # Drop shards that are mostly stale and convert their live records again
+            removed = []
+            for name, shard_hashes in shards.items():
+                used = sum(1 for h in shard_hashes if h in counts)
+                if used < len(shard_hashes) * MIN_LIVE_FRACTION:
+                    removed.append(name)
+                    stored.difference_update(shard_hashes)
+            for name in removed:
+                del manifest["shards"][name]
+                del shards[name]
+            if removed:
+                for record in self.records(source):
+                    h = record_hash(record)
+                    if h in counts and h not in stored and h not in writer.pending:
+                        writer.add(h, record)
+            writer.flush()
+
+        stored.update(writer.pending)
+        manifest["records"] = sum(counts.values())
+        manifest["counts"] = {h: counts[h] for h in stored if counts[h] != 1}
+        self.save_manifest(manifest)
+        for name in removed:
+            os.remove(os.path.join(self.path, name))
+            os.remove(os.path.join(self.path, name + ".hashes"))
+        written = writer.written
+        return {
+            "records": manifest["records"],
+            "converted": len(writer.pending),
+            "reused": manifest["records"] - sum(counts[h] for h in writer.pending),
+            "shards": len(manifest["shards"]),
+            "new_shards": written,
+            "removed_shards": len(removed),
+            "misaligned": sum(shard["misaligned"] for shard in written.values()),
+            "time_s": round(time.perf_counter() - started, 3),
+        }
+
+    def shard_docs(self, name, vocab, counts):
+        """Yield the docs of one shard, each as many times as its record occurs in the dataset"""
+        db = DocBin().from_disk(os.path.join(self.path, name))
+        for h, doc in zip(self.shard_hashes(name), db.get_docs(vocab)):
+            for _ in range(counts.get(h, 1)):
+                yield doc
+
+    def docs(self, vocab):
+        """Yield one doc per record of the last converted dataset, shard by shard"""
+        manifest = self.load_manifest()
+        for name in manifest["shards"]:
+            yield from self.shard_docs(name, vocab, manifest["counts"])
+
+    def shuffled_docs(self, vocab, buffer_size=10000, rng=random):
+        """Yield one doc per record in random order, holding at most buffer_size docs and one shard at a time.
+
+        Shards are visited in random order and their docs pass through a
+        shuffle buffer: every incoming doc replaces a random buffered doc,
+        which is yielded.
+        """
+        manifest = self.load_manifest()
+        names = list(manifest["shards"])
+        rng.shuffle(names)
+        buffer = []
+        for name in names:
+            for doc in self.shard_docs(name, vocab, manifest["counts"]):
+                if len(buffer) < buffer_size:
+                    buffer.append(doc)
+                    continue
+                i = rng.randrange(buffer_size)
+                yield buffer[i]
+                buffer[i] = doc
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def sample_docs(self, vocab, k, rng=random):
+        """Return a uniform random sample of k docs (reservoir sampling over one pass of the shards)"""
+        sample = []
+        for i, doc in enumerate(self.docs(vocab)):
+            if i < k:
+                sample.append(doc)
+            else:
+                j = rng.randrange(i + 1)
+                if j < k:
+                    sample[j] = doc
+        return sample
+
+    def __len__(self):
+        return self.load_manifest()["records"]
+
+
+class ShardWriter:
+    """Cuts new records into shards of corpus.shard_size and converts them on worker processes.
+
+    At most two shards per worker are queued at once, so memory stays bounded
+    however large the input is. Finished shards are added to the manifest in
+    the order they were cut.
+    """
+
+    def __init__(self, corpus, manifest):
+        self.corpus = corpus
+        self.manifest = manifest
+        self.executor = ProcessPoolExecutor(corpus.workers) if corpus.workers > 1 else None
+        self.batch = []
+        self.pending = set()
+        self.running = {}
+        self.order = []
+        self.written = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=exc_info[0] is not None)
+
+    def add(self, h, record):
+        self.pending.add(h)
+        self.batch.append((h, record))
+        if len(self.batch) >= self.corpus.shard_size:
+            self.submit()
+
+    def submit(self):
+        name = f"shard-{self.manifest['next_shard']:05d}.spacy"
+        self.manifest["next_shard"] += 1
+        self.order.append(name)
+        hashes = [h for h, _ in self.batch]
+        records = [record for _, record in self.batch]
+        self.batch = []
+        path = os.path.join(self.corpus.path, name)
+        with open(path + ".hashes", "w") as f:
+            f.write("\n".join(hashes) + "\n")
+        if self.executor is None:
+            self.finish(name, len(hashes), convert_shard(path, records))
+            return
+        while len(self.running) >= 2 * self.corpus.workers:
+            done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.finish(*self.running.pop(future), future.result())
+        self.running[self.executor.submit(convert_shard, path, records)] = (name, len(hashes))
+
+    def finish(self, name, docs, result):
+        entities, misaligned = result
+        if misaligned:
+            logger.warning("%s: %d of %d entities do not align to token boundaries and were dropped",
+                           name, misaligned, entities)
+        self.written[name] = {"docs": docs, "entities": entities, "misaligned": misaligned}
+
+    def flush(self):
+        """Convert the last, partial shard, wait for all shards and record them in the manifest"""
+        if self.batch:
+            self.submit()
+        for future in list(self.running):
+            self.finish(*self.running.pop(future), future.result())
+        for name in self.order:
+            self.manifest["shards"][name] = self.written[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("--input", default=DEFAULT_INPUT_PATH, help="JSON array or JSON Lines file to convert")
+    parser.add_argument("--shards", default=DEFAULT_SHARD_DIR, help="Shard directory")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="Docs per new shard")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Conversion processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stats = ShardedCorpus(args.shards, shard_size=args.shard_size, workers=args.workers).update(args.input)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
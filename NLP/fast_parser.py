@@ -0,0 +1,150 @@
+"""
+Compiled fast path for canonical single-clause prompts
+
+Prompts that follow the README grammar exactly, e.g.
+    Send 0.5 ETH to Bob on Base
+    swap 5 USDC for ETH on Optimism mainnet
+    Bridge 1 ETH from Base to Ethereum
+    check balance of USDC for Alice on Base
+are parsed with one precompiled regular expression per intent and produce the
+same result as the spaCy pipeline. Anything else returns None and must go
+through the pipeline.
+"""
+
+import re
+import threading
+
+from skeleton_cache import KEYWORDS
+
+NUM = r"[0-9]+(?:\.[0-9]+)?"
+ADDR = r"0x[a-fA-F0-9]{40}"
+NAME = r"[A-Za-z]+"
+TOKEN = r"ETH|USDC"
+NET = r"Ethereum|Base|Optimism"
+TIER = r"(?i:mainnet|testnet)"
+ON_NETWORK = rf"(?: (?i:on) (?P<net>{NET})(?: {TIER})?)?"
+
+TRANSFER_RE = re.compile(
+    rf"(?i:send|transfer|move) (?:(?P<amount>{NUM}) )?(?P<token>{TOKEN}) (?i:to) "
+    rf"(?:(?P<addr>{ADDR})|(?P<name>{NAME})){ON_NETWORK}"
+)
+SWAP_RE = re.compile(
+    rf"(?i:swap) (?:(?P<amount>{NUM}) )?(?P<token>{TOKEN}) (?i:for) (?P<token2>{TOKEN}){ON_NETWORK}"
+)
+BRIDGE_RE = re.compile(
+    rf"(?:(?i:execute) )?(?i:bridge) (?:(?P<amount>{NUM}) )?(?P<token>{TOKEN}) "
+    rf"(?i:from|on) (?P<source>{NET})(?: {TIER})? (?i:to) (?P<dest>{NET})(?: {TIER})?"
+)
+QUERY_RE = re.compile(
+    rf"(?i:check|get|query|show) (?P<query_type>(?i:balance|amount))(?: (?i:of) (?P<token>{TOKEN}))?"
+    rf"(?: (?i:for) (?:(?P<addr>{ADDR})|(?P<name>{NAME})))?{ON_NETWORK}"
+)
+
+
+def empty_parameters():
+    return {
+        "from": "User",
+        "to": None,
+        "source_network": None,
+        "dest_network": None,
+        "tokens": [],
+        "token2": None,
+        "query_type": None
+    }
+
+
+class FastParser:
+    """Regex parser for the canonical Transfer/Swap/Bridge/Query forms.
+
+    special_cases is the tokenizer's exception table. A recipient name that is
+    a tokenizer special case (e.g. "Cannot") would not be a single token, so
+    such prompts are left to the pipeline.
+    """
+
+    def __init__(self, special_cases=(), enabled=True):
+        self.special_cases = set(special_cases)
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_name(self, name):
+        return name.lower() not in KEYWORDS and name not in self.special_cases
+
+    def parse_parameters(self, prompt):
+        """Return (intent, parameters) for a canonical normalized prompt, or None"""
+        match = TRANSFER_RE.fullmatch(prompt)
+        if match:
+            if match["name"] is not None and not self.is_name(match["name"]):
+                return None
+            parameters = empty_parameters()
+            parameters["tokens"].append({"amount": match["amount"], "token": match["token"]})
+            parameters["to"] = match["addr"] or match["name"]
+            parameters["source_network"] = parameters["dest_network"] = match["net"]
+            return "Transfer", parameters
+
+        match = SWAP_RE.fullmatch(prompt)
+        if match:
+            parameters = empty_parameters()
+            parameters["tokens"].append({"amount": match["amount"], "token": match["token"]})
+            if match["token2"] != match["token"]:
+                parameters["tokens"].append({"amount": None, "token": match["token2"]})
+            parameters["token2"] = match["token2"]
+            parameters["to"] = "User"
+            parameters["source_network"] = parameters["dest_network"] = match["net"]
+            return "Swap", parameters
+
+        match = BRIDGE_RE.fullmatch(prompt)
+        if match:
+            parameters = empty_parameters()
+            parameters["tokens"].append({"amount": match["amount"], "token": match["token"]})
+            parameters["to"] = "User"
+            parameters["source_network"] = match["source"]
+            parameters["dest_network"] = match["dest"]
+            return "Bridge", parameters
+
+        match = QUERY_RE.fullmatch(prompt)
+        if match:
+            if match["name"] is not None and not self.is_name(match["name"]):
+                return None
+            parameters = empty_parameters()
+            if match["token"]:
+                parameters["tokens"].append({"amount": None, "token": match["token"]})
+            parameters["to"] = match["addr"] or match["name"]
+            parameters["query_type"] = match["query_type"]
+            parameters["source_network"] = parameters["dest_network"] = match["net"]
+            return "Query", parameters
+
+        return None
+
+    def parse(self, prompt):
+        """Return the /process_prompt result for a canonical normalized prompt, or None to fall back"""
+        if not self.enabled:
+            return None
+        parsed = self.parse_parameters(prompt)
+        with self.lock:
+            if parsed is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if parsed is None:
+            return None
+        intent, parameters = parsed
+        return {
+            "status": "success",
+            "result": {
+                "intent_count": 1,
+                "intent": intent,
+                "parameters": parameters
+            }
+        }
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "fallbacks": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+            }
@@ -0,0 +1,162 @@
+"""
+Minimal Prometheus metrics: counters, gauges and histograms rendered in the text exposition format
+"""
+
+import math
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request latency buckets in seconds, from 0.5 ms to 5 s
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Pipeline stage buckets in seconds, from 50 us to 1 s
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A named metric holding one value per combination of label values.
+
+    Updates take a per-metric lock held only for a dict update, so recording
+    from request handlers and pipeline worker threads stays cheap.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for every sample"""
+        with self.lock:
+            values = list(self.values.items())
+        for labelvalues, value in values:
+            yield "", labelvalues, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labelvalues, extra, value in self.samples():
+            labels = format_labels(self.labelnames, labelvalues, extra)
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down; set_function makes it read a callback at scrape time instead"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.function = None
+
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            yield "", (), (), self.function()
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, plus their count and sum"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues, count=1):
+        """Record value; count records it that many times, e.g. once per doc of a batch"""
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labelvalues)
+            if state is None:
+                # Bucket counts (the last one is +Inf), then the sum
+                state = self.values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += count
+            state[-1] += value * count
+
+    def totals(self):
+        """{label values: (count, sum)} of everything observed so far"""
+        with self.lock:
+            return {labelvalues: (sum(state[:-1]), state[-1]) for labelvalues, state in self.values.items()}
+
+    def samples(self):
+        with self.lock:
+            values = [(labelvalues, list(state)) for labelvalues, state in self.values.items()]
+        for labelvalues, state in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), state):
+                cumulative += bucket_count
+                yield "_bucket", labelvalues, (("le", format_value(float(bound))),), cumulative
+            yield "_count", labelvalues, (), cumulative
+            yield "_sum", labelvalues, (), state[-1]
+
+
+class Registry:
+    """The metrics exported by one process"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
@@ -1,18 +1,66 @@
+import time
+
+# Startup phases are timed from here, before the heavy imports
+startup_started = time.perf_counter()
+
 import spacy
 from spacy.language import Language
 from spacy.matcher import Matcher
 from spacy.tokens import Doc
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import json
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, Field
+import asyncio
+import hashlib
+import hmac
+import pickle
+import queue
+import random
 import re
+from bisect import bisect_right
 import logging
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from datetime import datetime
+from prompt_cache import PromptCache, normalize_prompt
+from skeleton_cache import SkeletonCache
+from fast_parser import FastParser
+from metrics import CONTENT_TYPE, STAGE_BUCKETS, Registry
+from profiler import SampledProfiler
+from tracing import SlowLog, Trace
+from structured_log import setup_logging
+from training_store import AsyncLogWriter, TrainingLog
+import pipeline_artifact
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class StartupTimer:
+    """Seconds spent in each startup phase, each measured from the end of the previous one"""
+
+    def __init__(self, started):
+        self.started = self.last = started
+        self.ready = None
+        self.phases = {}
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def summary(self):
+        """Time until the module was loaded and until warm-up finished (None before), and per phase"""
+        return {
+            "loaded_ms": round(1000 * (self.last - self.started), 1),
+            "ready_ms": round(1000 * (self.ready - self.started), 1) if self.ready else None,
+            "phases_ms": {name: round(1000 * seconds, 1) for name, seconds in self.phases.items()},
+        }
+
+
+startup_timer = StartupTimer(startup_started)
+startup_timer.phase("imports")
+
 # Initialize FastAPI app
 app = FastAPI()
 
@@ -24,109 +72,203 @@ if __name__ == "__main__":
 # Load spaCy model (default or trained model if available)
 import os
 
+# Logging: records are queued and written to stderr by a listener thread, as JSON lines
+# (NLP_LOG_FORMAT=json) or text lines (text)
+LOG_LEVEL = os.environ.get("NLP_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("NLP_LOG_FORMAT", "json")
+log_handler = setup_logging(LOG_LEVEL, LOG_FORMAT)
+
+# Fraction of requests logged with their prompt and full result; errors are always logged
+LOG_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("NLP_LOG_SAMPLE_RATE", "0.01"))))
+
+# Default nlp.pipe batch size for /process_prompts
+DEFAULT_BATCH_SIZE = int(os.environ.get("NLP_BATCH_SIZE", "64"))
+
+# Number of pipeline replicas (and inference threads) serving requests
+POOL_SIZE = max(1, int(os.environ.get("NLP_POOL_SIZE", "2")))
+
+# Pipeline calls (micro-batches or /process_prompts requests) that may wait for a free replica on
+# top of the running ones; beyond that requests get 503 instead of queueing without bound
+POOL_QUEUE_SIZE = max(0, int(os.environ.get("NLP_POOL_QUEUE_SIZE", str(4 * POOL_SIZE))))
+
+# Micro-batching of concurrent /process_prompt calls: how long the first request
+# in a batch may wait for others to join, and the largest batch to form
+BATCH_MAX_WAIT_MS = float(os.environ.get("NLP_BATCH_MAX_WAIT_MS", "2"))
+BATCH_MAX_SIZE = max(1, int(os.environ.get("NLP_BATCH_MAX_SIZE", "32")))
+
+# Parsed-result cache: max entries (0 disables) and optional TTL in seconds (0 = no expiry)
+CACHE_SIZE = max(0, int(os.environ.get("NLP_CACHE_SIZE", "4096")))
+CACHE_TTL_S = float(os.environ.get("NLP_CACHE_TTL_S", "0"))
+
+# Skeleton cache: max templates (0 disables), sharing NLP_CACHE_TTL_S
+SKELETON_CACHE_SIZE = max(0, int(os.environ.get("NLP_SKELETON_CACHE_SIZE", "1024")))
+
+# Longest prompt accepted, in characters; longer prompts are rejected before parsing
+MAX_PROMPT_CHARS = max(1, int(os.environ.get("NLP_MAX_PROMPT_CHARS", "5000")))
+
+# Regex fast path for canonical prompts (set to 0 to always use the pipeline)
+FAST_PATH = os.environ.get("NLP_FAST_PATH", "1") != "0"
+
+# "full" runs every component of the loaded model; "rules" keeps only the tokenizer,
+# sentencizer and intent_parameters, which is all the parse result depends on
+SERVING_MODE = os.environ.get("NLP_SERVING_MODE", "full")
+if SERVING_MODE not in ("full", "rules"):
+    raise ValueError(f"NLP_SERVING_MODE must be 'full' or 'rules', got {SERVING_MODE!r}")
+
+# Trained components intent_parameters never reads, excluded from the model in rules mode
+UNUSED_COMPONENTS = ["tok2vec", "tagger", "morphologizer", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"]
+
 # Get the current directory and construct the model path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(current_dir, "model", "model-best")
 
-try:
-    nlp = spacy.load(model_path)
-    logger.info(f"Loaded custom spaCy model from {model_path}")
-except Exception as e:
-    logger.warning(f"Failed to load custom model from {model_path}, using fallback model en_core_web_sm. Error: {str(e)}")
-    try:
-        nlp = spacy.load("en_core_web_sm")
-        logger.info("Successfully loaded fallback model en_core_web_sm")
-    except Exception as fallback_error:
-        logger.error(f"Failed to load fallback model: {str(fallback_error)}")
-        # Create a blank model as last resort
-        nlp = spacy.blank("en")
-        logger.info("Created blank spaCy model as last resort")
+# The finished serving pipeline, pickled after the model is loaded and unpickled on later starts
+# while the model files, spaCy version, serving mode and patterns still match. NLP_PIPELINE_ARTIFACT
+# sets the path (default .cache/pipeline-<mode>.pkl); empty disables it
+PIPELINE_ARTIFACT = pipeline_artifact.configured_path(SERVING_MODE)
+
+# Append-only log that /log_prompt and /add_annotated_prompt write to;
+# fold it into train_data.json with `python training_store.py compact`
+TRAIN_LOG_PATH = os.environ.get("NLP_TRAIN_LOG", os.path.join(current_dir, "train_data.jsonl"))
+training_log = TrainingLog(TRAIN_LOG_PATH)
+
+# Records are queued and written in the background: queue bound, records per write
+# and the longest a record waits before being flushed
+LOG_QUEUE_SIZE = max(1, int(os.environ.get("NLP_LOG_QUEUE_SIZE", "10000")))
+LOG_BATCH_SIZE = max(1, int(os.environ.get("NLP_LOG_BATCH_SIZE", "256")))
+LOG_FLUSH_INTERVAL_MS = float(os.environ.get("NLP_LOG_FLUSH_INTERVAL_MS", "200"))
+training_log_writer = AsyncLogWriter(training_log, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                                     flush_interval=LOG_FLUSH_INTERVAL_MS / 1000)
+
+# Fraction of pipeline calls run under cProfile (0 = off); can be changed at runtime via /admin/profile
+PROFILE_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("NLP_PROFILE_SAMPLE_RATE", "0"))))
+PROFILE_DIR = os.environ.get("NLP_PROFILE_DIR", os.path.join(current_dir, "profiles"))
+pipeline_profiler = SampledProfiler(PROFILE_SAMPLE_RATE)
+
+# Requests slower than NLP_SLOW_REQUEST_MS are written with their stage timings to a
+# Chrome trace event file (open it in ui.perfetto.dev); an empty NLP_SLOW_LOG disables it.
+# Past NLP_SLOW_LOG_MAX_MB the file is moved to <file>.1 and a new one is started
+SLOW_REQUEST_MS = float(os.environ.get("NLP_SLOW_REQUEST_MS", "100"))
+SLOW_LOG_PATH = os.environ.get("NLP_SLOW_LOG", os.path.join(current_dir, "slow_requests.trace.json"))
+SLOW_LOG_MAX_MB = max(0.1, float(os.environ.get("NLP_SLOW_LOG_MAX_MB", "20")))
+slow_log = SlowLog(SLOW_LOG_PATH, threshold_ms=SLOW_REQUEST_MS, max_bytes=int(SLOW_LOG_MAX_MB * 2**20))
+
+# The trace of the request being handled, set by the RequestMetrics middleware
+request_trace = ContextVar("request_trace", default=None)
+
+# Token required in the X-Admin-Token header by /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get("NLP_ADMIN_TOKEN")
 
 # Register custom attributes on Doc
 Doc.set_extension("intent", default=None, force=True)
 Doc.set_extension("parameters", default=None, force=True)
 
+# Patterns for parameters - Updated to handle decimals and new networks/tokens
+# Built into the matcher once per pipeline by the intent_parameters factory
+amount_pattern = [
+    {"TEXT": {"REGEX": r"^\d+(\.\d+)?$"}},  # Matches whole numbers and decimals
+    {"TEXT": {"IN": ["ETH", "USDC"]}}
+]
+token_pattern = [{"TEXT": {"IN": ["ETH", "USDC"]}}]
+
+# Modified recipient pattern - exclude token names and network names to avoid conflicts
+recipient_pattern = [
+    {"LOWER": {"IN": ["to", "for"]}},
+    {"IS_ALPHA": True, "TEXT": {"NOT_IN": ["ETH", "USDC", "Ethereum", "Base", "Optimism", "on", "from"]}}
+]
+
+address_pattern = [
+    {"LOWER": {"IN": ["to", "for"]}},
+    {"TEXT": {"REGEX": "^0x[a-fA-F0-9]{40}$"}}
+]
+source_network_pattern = [
+    {"LOWER": {"IN": ["from", "on"]}},
+    {"TEXT": {"IN": ["Ethereum", "Base", "Optimism"]}},
+    {"LOWER": {"IN": ["mainnet", "testnet"]}, "OP": "?"}
+]
+dest_network_pattern = [
+    {"LOWER": {"IN": ["on", "to"]}},
+    {"TEXT": {"IN": ["Ethereum", "Base", "Optimism"]}},
+    {"LOWER": {"IN": ["mainnet", "testnet"]}, "OP": "?"}
+]
+token2_pattern = [
+    {"LOWER": "for"},
+    {"TEXT": {"IN": ["ETH", "USDC"]}}
+]
+query_type_pattern = [
+    {"LOWER": {"IN": ["balance", "amount"]}}
+]
+bridge_keyword_pattern = [
+    {"LOWER": {"IN": ["via", "through"]}, "OP": "?"},
+    {"LOWER": "bridge"}
+]
+intent_transfer_pattern = [{"LOWER": {"IN": ["send", "transfer", "move"]}}]
+intent_swap_pattern = [{"LOWER": "swap"}]
+intent_bridge_pattern = [{"LOWER": {"IN": ["bridge", "execute"]}, "OP": "?"}, {"LOWER": "bridge"}]
+intent_query_pattern = [{"LOWER": {"IN": ["check", "get", "query", "show"]}}]
+
+# Matcher labels, in the order they are added to the matcher
+INTENT_PARAMETER_PATTERNS = {
+    "AMOUNT": [amount_pattern],
+    "TOKEN": [token_pattern],
+    "RECIPIENT": [recipient_pattern],
+    "ADDRESS": [address_pattern],
+    "SOURCE_NETWORK": [source_network_pattern],
+    "DEST_NETWORK": [dest_network_pattern],
+    "TOKEN2": [token2_pattern],
+    "QUERY_TYPE": [query_type_pattern],
+    "BRIDGE_KEYWORD": [bridge_keyword_pattern],
+    "INTENT_TRANSFER": [intent_transfer_pattern],
+    "INTENT_SWAP": [intent_swap_pattern],
+    "INTENT_BRIDGE": [intent_bridge_pattern],
+    "INTENT_QUERY": [intent_query_pattern],
+}
+
+
+# Part of the pipeline artifact key: bump when IntentParameters.__init__ builds different state
+# (the patterns it compiles are keyed on their own)
+COMPONENT_VERSION = 1
+
+
+class IntentParameters:
+    """Stateful intent_parameters component.
+
+    The matcher and its label lookups are compiled once when the pipeline is
+    built and reused for every Doc.
+    """
+
+    def __init__(self, nlp, name):
+        self.name = name
+        self.matcher = Matcher(nlp.vocab)
+        for label, patterns in INTENT_PARAMETER_PATTERNS.items():
+            self.matcher.add(label, patterns)
+        # match_id -> label string, resolved once instead of per match
+        self.labels = {nlp.vocab.strings.add(label): label for label in INTENT_PARAMETER_PATTERNS}
+
+    def __call__(self, doc):
+        return extract_intent_parameters(doc, self.matcher, self.labels)
+
+
 # Add custom intent_parameters component to spaCy pipeline
-@Language.component("intent_parameters")
-def extract_intent_parameters(doc):
-    matcher = Matcher(nlp.vocab)
-    
-    # Patterns for parameters - Updated to handle decimals and new networks/tokens
-    amount_pattern = [
-        {"TEXT": {"REGEX": r"^\d+(\.\d+)?$"}},  # Matches whole numbers and decimals
-        {"TEXT": {"IN": ["ETH", "USDC"]}}
-    ]
-    token_pattern = [{"TEXT": {"IN": ["ETH", "USDC"]}}]
-    
-    # Modified recipient pattern - exclude token names and network names to avoid conflicts
-    recipient_pattern = [
-        {"LOWER": {"IN": ["to", "for"]}},
-        {"IS_ALPHA": True, "TEXT": {"NOT_IN": ["ETH", "USDC", "Ethereum", "Base", "Optimism", "on", "from"]}}
-    ]
-    
-    address_pattern = [
-        {"LOWER": {"IN": ["to", "for"]}},
-        {"TEXT": {"REGEX": "^0x[a-fA-F0-9]{40}$"}}
-    ]
-    source_network_pattern = [
-        {"LOWER": {"IN": ["from", "on"]}},
-        {"TEXT": {"IN": ["Ethereum", "Base", "Optimism"]}},
-        {"LOWER": {"IN": ["mainnet", "testnet"]}, "OP": "?"}
-    ]
-    dest_network_pattern = [
-        {"LOWER": {"IN": ["on", "to"]}},
-        {"TEXT": {"IN": ["Ethereum", "Base", "Optimism"]}},
-        {"LOWER": {"IN": ["mainnet", "testnet"]}, "OP": "?"}
-    ]
-    token2_pattern = [
-        {"LOWER": "for"},
-        {"TEXT": {"IN": ["ETH", "USDC"]}}
-    ]
-    query_type_pattern = [
-        {"LOWER": {"IN": ["balance", "amount"]}}
-    ]
-    bridge_keyword_pattern = [
-        {"LOWER": {"IN": ["via", "through"]}, "OP": "?"},
-        {"LOWER": "bridge"}
-    ]
-    intent_transfer_pattern = [{"LOWER": {"IN": ["send", "transfer", "move"]}}]
-    intent_swap_pattern = [{"LOWER": "swap"}]
-    intent_bridge_pattern = [{"LOWER": {"IN": ["bridge", "execute"]}, "OP": "?"}, {"LOWER": "bridge"}]
-    intent_query_pattern = [{"LOWER": {"IN": ["check", "get", "query", "show"]}}]
-    
-    matcher.add("AMOUNT", [amount_pattern])
-    matcher.add("TOKEN", [token_pattern])
-    matcher.add("RECIPIENT", [recipient_pattern])
-    matcher.add("ADDRESS", [address_pattern])
-    matcher.add("SOURCE_NETWORK", [source_network_pattern])
-    matcher.add("DEST_NETWORK", [dest_network_pattern])
-    matcher.add("TOKEN2", [token2_pattern])
-    matcher.add("QUERY_TYPE", [query_type_pattern])
-    matcher.add("BRIDGE_KEYWORD", [bridge_keyword_pattern])
-    matcher.add("INTENT_TRANSFER", [intent_transfer_pattern])
-    matcher.add("INTENT_SWAP", [intent_swap_pattern])
-    matcher.add("INTENT_BRIDGE", [intent_bridge_pattern])
-    matcher.add("INTENT_QUERY", [intent_query_pattern])
-    
-    # Split into sentences and find clause boundaries
-    sentences = list(doc.sents)
+@Language.factory("intent_parameters")
+def create_intent_parameters(nlp, name):
+    return IntentParameters(nlp, name)
+
+
+def extract_intent_parameters(doc, matcher, labels):
+    # One matcher pass over the whole doc; matches are ordered by start position
+    matches = [(labels[match_id], start, end) for match_id, start, end in matcher(doc)]
     
-    # Find all intent keywords and their positions to identify clause boundaries
+    # Find all intent keywords and their positions to identify clause boundaries.
+    # An intent keyword may not span a sentence boundary.
     intent_positions = []
-    for sent in sentences:
-        matches = matcher(sent)
-        for match_id, start, end in matches:
-            match_label = nlp.vocab.strings[match_id]
-            if match_label.startswith("INTENT_"):
-                # Convert sentence-relative positions to document-relative positions
-                doc_start = sent.start + start
-                doc_end = sent.start + end
-                intent_positions.append({
-                    'label': match_label,
-                    'start': doc_start,
-                    'end': doc_end,
-                    'sent_idx': sentences.index(sent)
-                })
+    for match_label, start, end in matches:
+        if match_label.startswith("INTENT_") and not any(doc[j].is_sent_start for j in range(start + 1, end)):
+            intent_positions.append({
+                'label': match_label,
+                'start': start,
+                'end': end
+            })
     
     # If no intents found, return empty result
     if not intent_positions:
@@ -142,24 +284,27 @@ def extract_intent_parameters(doc):
         }
         return doc
     
+    # Each intent's scope runs from its start to the next intent's start (or the end of the doc).
+    # Assign every match that fits inside a scope to it by binary search over the scope starts;
+    # with equal starts the last intent owns the scope, the others' scopes are empty.
+    scope_starts = [intent_pos['start'] for intent_pos in intent_positions]
+    scope_ends = scope_starts[1:] + [len(doc)]
+    matches_by_scope = [[] for _ in intent_positions]
+    for match_label, start, end in matches:
+        i = bisect_right(scope_starts, start) - 1
+        if i >= 0 and end <= scope_ends[i]:
+            # Positions relative to the scope span
+            matches_by_scope[i].append((match_label, start - scope_starts[i], end - scope_starts[i]))
+    
     # Process each intent and its associated parameters
     multi_intents = []
     
     for i, intent_pos in enumerate(intent_positions):
         intent_label = intent_pos['label']
-        intent_start = intent_pos['start']
-        
-        # Determine the scope for this intent (from this intent to the next one or end of document)
-        if i < len(intent_positions) - 1:
-            scope_end = intent_positions[i + 1]['start']
-        else:
-            scope_end = len(doc)
         
         # Create a span for this intent's scope
-        intent_scope = doc[intent_start:scope_end]
-        
-        # Extract parameters within this scope
-        scope_matches = matcher(intent_scope)
+        intent_scope = doc[scope_starts[i]:scope_ends[i]]
+        scope_matches = matches_by_scope[i]
         
         intent = None
         parameters = {
@@ -186,9 +331,8 @@ def extract_intent_parameters(doc):
         processed_tokens = set()
         
         # Process matches within this intent's scope
-        for match_id, start, end in scope_matches:
+        for match_label, start, end in scope_matches:
             span = intent_scope[start:end]
-            match_label = nlp.vocab.strings[match_id]
             
             if match_label == "AMOUNT":
                 amount = span[0].text
@@ -301,79 +445,713 @@ def extract_intent_parameters(doc):
     
     return doc
 
-# Add custom component and sentencizer to spaCy pipeline
-nlp.add_pipe("intent_parameters", last=True)
-logger.info("Added intent_parameters to spaCy pipeline")
-if "sentencizer" not in nlp.pipe_names:
-    nlp.add_pipe("sentencizer", before="intent_parameters")
-    logger.info("Added sentencizer to spaCy pipeline")
+def load_pipeline():
+    """Load the spaCy model (custom, then fallback, then blank) and add our components.
+
+    Returns (nlp, model_status, model_location).
+    """
+    exclude = UNUSED_COMPONENTS if SERVING_MODE == "rules" else []
+    try:
+        nlp = spacy.load(model_path, exclude=exclude)
+        model_status, model_location = "custom_model", model_path
+        logger.info(f"Loaded custom spaCy model from {model_path}")
+    except Exception as e:
+        logger.warning(f"Failed to load custom model from {model_path}, using fallback model en_core_web_sm. Error: {str(e)}")
+        try:
+            nlp = spacy.load("en_core_web_sm", exclude=exclude)
+            model_status, model_location = "fallback_model", "en_core_web_sm"
+            logger.info("Successfully loaded fallback model en_core_web_sm")
+        except Exception as fallback_error:
+            logger.error(f"Failed to load fallback model: {str(fallback_error)}")
+            # Create a blank model as last resort
+            nlp = spacy.blank("en")
+            model_status, model_location = "blank_model", "blank:en"
+            logger.info("Created blank spaCy model as last resort")
+
+    # Add custom component and sentencizer to spaCy pipeline
+    nlp.add_pipe("intent_parameters", last=True)
+    logger.info("Added intent_parameters to spaCy pipeline")
+    if "sentencizer" not in nlp.pipe_names:
+        nlp.add_pipe("sentencizer", before="intent_parameters")
+        logger.info("Added sentencizer to spaCy pipeline")
+    logger.info("Serving mode %s, pipeline: %s", SERVING_MODE, nlp.pipe_names)
+    return nlp, model_status, model_location
+
+
+def model_fingerprint(pipeline):
+    """Short content hash of the loaded model's weights and config, computed once at startup"""
+    # The sentencizer serializes its punctuation set in hash order, so leave it to the config
+    return hashlib.sha256(pipeline.to_bytes(exclude=["vocab", "sentencizer"])).hexdigest()[:16]
+
+
+def pipeline_artifact_key(model_digest):
+    """Key of the pipeline artifact: a digest of everything load_pipeline() builds the pipeline from"""
+    return pipeline_artifact.artifact_key(
+        model=model_digest,
+        # Only loaded when the custom model is missing
+        fallback=spacy.util.get_package_version("en_core_web_sm") if model_digest is None else None,
+        spacy=spacy.__version__,
+        thinc=spacy.util.get_package_version("thinc"),
+        serving_mode=SERVING_MODE,
+        patterns=INTENT_PARAMETER_PATTERNS,
+        # The pickled component carries the state its __init__ built
+        component=COMPONENT_VERSION,
+    )
+
+
+class PoolOverloaded(Exception):
+    """Raised instead of queueing a call when the pipeline pool already has max_pending calls"""
+
+
+class PipelinePool:
+    """Bounded executor over a fixed set of pipeline replicas.
+
+    spaCy inference is CPU-bound and a Language object is not safe to share
+    between threads, so each worker thread borrows its own replica for the
+    duration of a call. This keeps the event loop free to serve other requests.
+    At most queue_size calls wait for a replica; further calls are rejected
+    with PoolOverloaded.
+    """
+
+    def __init__(self, pipelines, queue_size=None):
+        self.size = len(pipelines)
+        self.idle = queue.SimpleQueue()
+        for pipeline in pipelines:
+            self.idle.put(pipeline)
+        # One worker per replica, so a worker never waits for a free pipeline
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="nlp")
+        self.max_pending = None if queue_size is None else self.size + queue_size
+        # Calls submitted and not finished; only changed on the event loop
+        self.pending = 0
+        self.rejected = 0
+        self.warmed_up = False
+
+    def _call(self, fn, args):
+        pipeline = self.idle.get()
+        try:
+            return pipeline_profiler.call(fn, pipeline, *args)
+        finally:
+            self.idle.put(pipeline)
+
+    async def run(self, fn, *args):
+        """Run fn(pipeline, *args) on a worker thread with a borrowed replica; raises PoolOverloaded when full"""
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolOverloaded(f"All {self.size} pipelines are busy and {self.max_pending - self.size} calls "
+                                 "are already waiting")
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(self.executor, self._call, fn, args)
+        finally:
+            self.pending -= 1
+
+    async def warm_up(self, prompts):
+        """Run prompts through every replica once; with one call per worker each gets its own replica"""
+        await asyncio.gather(*(self.run(lambda pipeline: list(pipeline.pipe(prompts))) for _ in range(self.size)))
+        self.warmed_up = True
+
+
+startup_timer.phase("config")
+model_digest = pipeline_artifact.directory_digest(model_path) if PIPELINE_ARTIFACT else None
+artifact_key = pipeline_artifact_key(model_digest) if PIPELINE_ARTIFACT else None
+startup_timer.phase("artifact_key")
+
+load_started = time.perf_counter()
+artifact = pipeline_artifact.load(PIPELINE_ARTIFACT, artifact_key) if PIPELINE_ARTIFACT else None
+if artifact is not None:
+    artifact_info, nlp, artifact_payload = artifact
+    model_status, model_id = artifact_info["model_status"], artifact_info["model_id"]
+    model_location = model_path if model_status == "custom_model" else "en_core_web_sm"
+    pipeline_source = "artifact"
+    logger.info("Loaded pipeline from %s (built %s), pipeline: %s", PIPELINE_ARTIFACT, artifact_info["created"],
+                nlp.pipe_names)
+    startup_timer.phase("pipeline")
+    replicas = [pickle.loads(artifact_payload) for _ in range(POOL_SIZE - 1)]
+else:
+    nlp, model_status, model_location = load_pipeline()
+    pipeline_source = "model"
+    startup_timer.phase("pipeline")
+    replicas = [load_pipeline()[0] for _ in range(POOL_SIZE - 1)]
+startup_timer.phase("replicas")
+pipeline_pool = PipelinePool([nlp] + replicas, POOL_QUEUE_SIZE)
+load_time_s = time.perf_counter() - load_started
+loaded_at = datetime.now().isoformat()
+
+artifact_written = False
+if pipeline_source == "model":
+    model_id = model_fingerprint(nlp)
+    startup_timer.phase("fingerprint")
+    # Save the pipeline for the next start, before any request adds to its vocab. A start that fell
+    # back from a custom model that exists (or to a blank model) is not saved.
+    if PIPELINE_ARTIFACT and model_status == ("custom_model" if model_digest is not None else "fallback_model"):
+        try:
+            size = pipeline_artifact.save(PIPELINE_ARTIFACT, nlp, artifact_key, {
+                "model_status": model_status, "model_id": model_id, "created": loaded_at})
+            artifact_written = True
+            logger.info("Wrote pipeline artifact %s (%.1f MB)", PIPELINE_ARTIFACT, size / 1e6)
+        except Exception as e:
+            logger.warning("Failed to write pipeline artifact %s: %s", PIPELINE_ARTIFACT, str(e))
+        startup_timer.phase("artifact_write")
+logger.info("Started pipeline pool with %d replicas from the %s in %.2fs (model %s)", pipeline_pool.size,
+            pipeline_source, load_time_s, model_id)
+
+# Prometheus metrics served at /metrics
+metrics = Registry()
+requests_total = metrics.counter("nlp_requests_total", "HTTP requests by endpoint and status code", ["endpoint", "status"])
+request_errors_total = metrics.counter("nlp_request_errors_total", "HTTP responses with a 4xx or 5xx status by endpoint",
+                                       ["endpoint"])
+prompt_errors_total = metrics.counter("nlp_prompt_errors_total", "Prompts that failed to parse inside a batch response",
+                                      ["endpoint"])
+request_duration = metrics.histogram("nlp_request_duration_seconds", "HTTP request latency by endpoint", ["endpoint"])
+requests_in_flight = metrics.gauge("nlp_requests_in_flight", "HTTP requests being served by endpoint", ["endpoint"])
+stage_duration = metrics.histogram(
+    "nlp_stage_duration_seconds",
+    "Time per doc spent in each pipeline stage (tokenizer, then each component); "
+    "the time of a batch is spread evenly over its docs",
+    ["stage"], buckets=STAGE_BUCKETS)
+slow_requests_total = metrics.counter("nlp_slow_requests_total",
+                                      f"Requests slower than NLP_SLOW_REQUEST_MS ({SLOW_REQUEST_MS:g} ms) by endpoint",
+                                      ["endpoint"])
+metrics.gauge("nlp_slow_log_dropped", "Slow request traces dropped because the writer fell behind").set_function(
+    lambda: slow_log.dropped)
+intents_total = metrics.counter("nlp_intents_total", "Parsed prompts by intent (None when no intent was found)",
+                                ["intent"])
+model_info = metrics.gauge("nlp_model_info", "The loaded model; status is custom_model, fallback_model or blank_model",
+                           ["status", "location", "fingerprint", "serving_mode", "pipeline"])
+model_info.set(1, model_status, model_location, model_id, SERVING_MODE, ",".join(nlp.pipe_names))
+startup_phase_seconds = metrics.gauge("nlp_startup_phase_seconds",
+                                      "Time spent in each phase of the last startup (imports, pipeline, ..., warm_up)",
+                                      ["phase"])
+pipelines_busy = metrics.gauge("nlp_pipelines_busy", "Pipeline replicas running a call")
+pipelines_busy.set_function(lambda: pipeline_pool.size - pipeline_pool.idle.qsize())
+metrics.gauge("nlp_pipelines", "Pipeline replicas in the pool").set(pipeline_pool.size)
+metrics.gauge("nlp_pool_rejected", "Pipeline calls rejected with 503 because the pool queue was full").set_function(
+    lambda: pipeline_pool.rejected)
+metrics.gauge("nlp_log_records_dropped", "Log records dropped because the log queue was full").set_function(
+    lambda: log_handler.dropped)
+
+# Exercise every component (and both single and multi-intent paths) before reporting ready
+WARMUP_PROMPTS = [
+    "Send 0.5 ETH to Bob on Base",
+    "swap 10 USDC for ETH on Optimism",
+    "Bridge 1 ETH from Ethereum to Base and check balance for Alice",
+]
+
+
+class LatencyWindow:
+    """Latencies of the most recent requests, for a rolling summary in /health"""
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+        def pct(p):
+            return round(1000 * samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 3)
+        return {
+            "count": len(samples),
+            "mean_ms": round(1000 * sum(samples) / len(samples), 3),
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+        }
+
+
+request_latency = LatencyWindow()
 
 # Define input models for FastAPI
 class PromptRequest(BaseModel):
     prompt: str
 
+class ProfileSettings(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+    reset: bool = False
+
+class BatchPromptRequest(BaseModel):
+    prompts: list[str]
+    batch_size: int = Field(default=DEFAULT_BATCH_SIZE, ge=1, le=1024)
+
 class AnnotatedPrompt(BaseModel):
     prompt: str
     entities: list[dict[str, int | str]]  # e.g., [{"start": 5, "end": 8, "label": "AMOUNT"}]
     intent: str | None
 
+def format_result(doc):
+    """Build the per-prompt response body for a processed Doc"""
+    return {
+        "status": "success",
+        "result": {
+            "intent_count": len(doc._.parameters.get("intents", [])) if doc._.intent == "Multi" else 1,
+            "intent": doc._.intent,
+            "parameters": doc._.parameters
+        }
+    }
+
+PROMPT_TOO_LONG = f"Prompt exceeds the maximum length of {MAX_PROMPT_CHARS} characters"
+
+def format_error(error):
+    """Build the per-prompt response body for a prompt that failed to parse"""
+    return {"status": "error", "error": str(error)}
+
+def run_pipeline(pipeline, prompts, batch_size, spans=None):
+    """Run prompts through pipeline as nlp.pipe would, recording the time spent in each stage.
+
+    If spans is a list, a (stage, start, end) tuple is appended to it for every stage.
+    """
+    if not prompts:
+        return []
+    started = time.perf_counter()
+    docs = [pipeline.make_doc(prompt) for prompt in prompts]
+    finished = time.perf_counter()
+    stage_duration.observe((finished - started) / len(docs), "tokenizer", count=len(docs))
+    if spans is not None:
+        spans.append(("tokenizer", started, finished))
+    for name, proc in pipeline.pipeline:
+        started = finished
+        if hasattr(proc, "pipe"):
+            docs = list(proc.pipe(docs, batch_size=batch_size))
+        else:
+            docs = [proc(doc) for doc in docs]
+        finished = time.perf_counter()
+        stage_duration.observe((finished - started) / len(docs), name, count=len(docs))
+        if spans is not None:
+            spans.append((name, started, finished))
+    return docs
+
+def parse_prompt(pipeline, prompt):
+    """Parse a single prompt with the given pipeline"""
+    return format_result(run_pipeline(pipeline, [prompt], 1)[0])
+
+def process_batch(pipeline, prompts, batch_size, spans=None):
+    """Run prompts through nlp.pipe, returning one result per prompt in input order.
+
+    If a batch raises, its prompts are re-run one at a time so a failure only
+    affects the prompt that caused it. spans collects stage timings as in run_pipeline.
+    """
+    results = []
+    for i in range(0, len(prompts), batch_size):
+        chunk = prompts[i:i + batch_size]
+        try:
+            docs = run_pipeline(pipeline, chunk, batch_size, spans)
+            started = time.perf_counter()
+            results.extend(format_result(doc) for doc in docs)
+            if spans is not None:
+                spans.append(("format_result", started, time.perf_counter()))
+        except Exception:
+            for prompt in chunk:
+                try:
+                    results.append(parse_prompt(pipeline, prompt))
+                except Exception as e:
+                    logger.error("Error processing prompt", extra={"fields": {"prompt": prompt, "error": str(e)}})
+                    results.append(format_error(e))
+    return results
+
+# The event loop only keeps weak references to tasks, so fire-and-forget tasks are held here until they finish
+background_tasks = set()
+
+
+def spawn(coro):
+    """Run coro as a background task that cannot be garbage-collected early and whose failure is logged"""
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background_task)
+    return task
+
+
+def finish_background_task(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task %s failed", task.get_coro().__qualname__, exc_info=task.exception())
+
+
+class MicroBatcher:
+    """Collects concurrent single-prompt requests into nlp.pipe batches.
+
+    A batch is dispatched to the pipeline pool once it reaches max_size prompts
+    or once its first prompt has waited max_wait_ms, whichever comes first.
+    Results are fanned back out to the waiting requests.
+    """
+
+    def __init__(self, pool, max_wait_ms, max_size):
+        self.pool = pool
+        self.max_wait = max_wait_ms / 1000
+        self.max_size = max_size
+        self.loop = None
+        self.queue = None
+        self.task = None
+        # Stats for tuning max_wait_ms / max_size
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def submit(self, prompt, trace=None):
+        """Queue a prompt and wait for its result, adding the batch's stage timings to trace"""
+        loop = asyncio.get_running_loop()
+        # The collector and its queue belong to the loop serving requests
+        if self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.task = None
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._collect())
+        future = loop.create_future()
+        await self.queue.put((prompt, future, time.perf_counter(), trace))
+        result = await future
+        if result["status"] == "error":
+            raise RuntimeError(result["error"])
+        return result
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    # Still take anything that is already queued
+                    if self.queue.empty():
+                        break
+                    batch.append(self.queue.get_nowait())
+                    continue
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Keep collecting the next batch while this one runs
+            spawn(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        dispatched_at = time.perf_counter()
+        self.batch_sizes[len(batch)] += 1
+        self.requests += len(batch)
+        for _, _, enqueued_at, _ in batch:
+            waited = dispatched_at - enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+        prompts = [prompt for prompt, _, _, _ in batch]
+        spans = []
+        try:
+            results = await self.pool.run(process_batch, prompts, len(prompts), spans)
+        except PoolOverloaded as e:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except Exception as e:
+            results = [format_error(e)] * len(batch)
+        for _, _, enqueued_at, trace in batch:
+            if trace is not None:
+                trace.add("queue_wait", enqueued_at, dispatched_at)
+                add_pipeline_spans(trace, dispatched_at, spans, batch_size=len(batch))
+        for (_, future, _, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_size,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "requests": self.requests,
+            "batches": batches,
+            "mean_batch_size": round(self.requests / batches, 2) if batches else None,
+            "batch_size_distribution": dict(sorted(self.batch_sizes.items())),
+            "mean_wait_ms": round(1000 * self.wait_total / self.requests, 3) if self.requests else None,
+            "max_wait_observed_ms": round(1000 * self.wait_max, 3),
+        }
+
+
+def add_pipeline_spans(trace, dispatched_at, spans, **args):
+    """Add a pipeline call's stage spans to trace, preceded by the wait for a free replica"""
+    if spans:
+        trace.add("pool_wait", dispatched_at, spans[0][1])
+    for name, start, end in spans:
+        trace.add(name, start, end, **args)
+
+
+def model_version(pipeline):
+    """Identity of the loaded model, so cached results never outlive a model change"""
+    meta = pipeline.meta
+    return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}:{'+'.join(pipeline.pipe_names)}:{model_id}"
+
+
+def copy_tokenizer(pipeline):
+    """A private copy of pipeline's tokenizer (with its own vocab), safe to use outside the pipeline pool"""
+    # Unpickling builds the special cases once; from_bytes() into a blank tokenizer built them twice
+    return pickle.loads(pickle.dumps(pipeline.tokenizer, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+micro_batcher = MicroBatcher(pipeline_pool, BATCH_MAX_WAIT_MS, BATCH_MAX_SIZE)
+result_cache = PromptCache(max_size=CACHE_SIZE, ttl=CACHE_TTL_S, version=model_version(nlp))
+skeleton_cache = SkeletonCache(copy_tokenizer(nlp), max_size=SKELETON_CACHE_SIZE, ttl=CACHE_TTL_S,
+                               version=model_version(nlp))
+fast_parser = FastParser(nlp.tokenizer.rules, enabled=FAST_PATH)
+metrics.gauge("nlp_batch_queue_depth", "Prompts waiting to join a micro-batch").set_function(
+    lambda: micro_batcher.queue.qsize() if micro_batcher.queue else 0)
+
+async def learn_skeleton_template(prompt, result, probe):
+    try:
+        probe_result = await micro_batcher.submit(probe)
+    except Exception as e:
+        logger.warning("Failed to learn skeleton template: %s", str(e))
+        skeleton_cache.forget(prompt)
+        return
+    skeleton_cache.learn(prompt, result, probe_result)
+
+def learn_skeleton(prompt, result):
+    """Learn the template for prompt's skeleton in the background if it is new"""
+    probe = skeleton_cache.probe_for(prompt)
+    if probe is not None:
+        spawn(learn_skeleton_template(prompt, result, probe))
+
+class RequestMetrics:
+    """ASGI middleware counting requests, errors, in-flight requests and latency per endpoint.
+
+    Every request is traced; handlers add spans to request_trace.get(), and
+    requests slower than NLP_SLOW_REQUEST_MS go to the slow log.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.endpoints = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.endpoints is None:
+            self.endpoints = {route.path for route in app.routes}
+        # Unknown paths share one label so scanners cannot grow the metrics without bound
+        endpoint = scope["path"] if scope["path"] in self.endpoints else "other"
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc(endpoint)
+        trace = Trace(f"{scope['method']} {endpoint}")
+        token = request_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_trace.reset(token)
+            trace.finish()
+            request_duration.observe(trace.duration, endpoint)
+            requests_in_flight.dec(endpoint)
+            requests_total.inc(endpoint, str(status))
+            if status >= 400:
+                request_errors_total.inc(endpoint)
+            trace.args["status"] = status
+            if slow_log.record(trace):
+                slow_requests_total.inc(endpoint)
+                logger.warning("Slow request", extra={"fields": {
+                    "request": trace.name, "ms": round(1000 * trace.duration, 3), **trace.args,
+                    "stages_ms": trace.stages()}})
+
+app.add_middleware(RequestMetrics)
+
+def count_intent(result):
+    if result["status"] == "success":
+        intents_total.inc(str(result["result"]["intent"]))
+
 # API endpoint to process prompts
 @app.post("/process_prompt")
 async def process_prompt(request: PromptRequest):
+    if len(request.prompt) > MAX_PROMPT_CHARS:
+        raise HTTPException(status_code=413, detail=PROMPT_TOO_LONG)
+    started = time.perf_counter()
+    trace = request_trace.get()
     try:
-        logger.info("Processing prompt: %s", request.prompt)
-        doc = nlp(request.prompt)
-        result = {
-            "status": "success",
-            "result": {
-                "intent_count": len(doc._.parameters.get("intents", [])) if doc._.intent == "Multi" else 1,
-                "intent": doc._.intent,
-                "parameters": doc._.parameters
-            }
-        }
-        logger.info("Processed prompt result: %s", json.dumps(result, indent=2))
+        prompt = normalize_prompt(request.prompt)
+        result = result_cache.get(prompt)
+        cached = result is not None
+        if not cached:
+            result = fast_parser.parse(prompt) or skeleton_cache.lookup(prompt)
+        if trace is not None:
+            trace.add("lookup", started, time.perf_counter())
+        if result is None:
+            result = await micro_batcher.submit(prompt, trace)
+            learn_skeleton(prompt, result)
+        if not cached:
+            result_cache.put(prompt, result)
+        request_latency.add(time.perf_counter() - started)
+        count_intent(result)
+        if random.random() < LOG_SAMPLE_RATE:
+            logger.info("Processed prompt", extra={"fields": {
+                "endpoint": "/process_prompt", "ms": round(1000 * (time.perf_counter() - started), 3),
+                "prompt": request.prompt, "result": result}})
+        if trace is not None:
+            trace.args.update(prompt_chars=len(request.prompt), clauses=result["result"]["intent_count"],
+                              intent=result["result"]["intent"])
+            trace.returned = time.perf_counter()
         return result
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
-        logger.error("Error processing prompt: %s", str(e))
+        logger.error("Error processing prompt", extra={"fields": {
+            "endpoint": "/process_prompt", "prompt": request.prompt, "error": str(e)}})
         raise HTTPException(status_code=500, detail=str(e))
 
-# Endpoint to log raw prompts for training data
-@app.post("/log_prompt")
-async def log_prompt(request: PromptRequest):
+# API endpoint to process a list of prompts in batches
+@app.post("/process_prompts")
+async def process_prompts(request: BatchPromptRequest):
+    started = time.perf_counter()
+    trace = request_trace.get()
     try:
-        new_data = {"prompt": request.prompt, "entities": [], "intent": None}
-        try:
-            with open("/home/oxunavailable/HAi Wallet/NLP/train_data.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = []
-        data.append(new_data)
-        with open("/home/oxunavailable/HAi Wallet/NLP/train_data.json", "w") as f:
-            json.dump(data, f, indent=2)
-        return {"status": "logged"}
+        prompts = [normalize_prompt(prompt) for prompt in request.prompts]
+        results = [
+            format_error(PROMPT_TOO_LONG) if len(raw) > MAX_PROMPT_CHARS
+            else result_cache.get(prompt) or fast_parser.parse(prompt) or skeleton_cache.lookup(prompt)
+            for raw, prompt in zip(request.prompts, prompts)
+        ]
+        missing = [i for i, result in enumerate(results) if result is None]
+        dispatched_at = time.perf_counter()
+        if trace is not None:
+            trace.add("lookup", started, dispatched_at)
+        if missing:
+            spans = []
+            parsed = await pipeline_pool.run(process_batch, [prompts[i] for i in missing], request.batch_size, spans)
+            if trace is not None:
+                add_pipeline_spans(trace, dispatched_at, spans, batch_size=len(missing))
+            for i, result in zip(missing, parsed):
+                results[i] = result
+                if result["status"] == "success":
+                    result_cache.put(prompts[i], result)
+                    learn_skeleton(prompts[i], result)
+        for result in results:
+            count_intent(result)
+        failed = sum(1 for result in results if result["status"] == "error")
+        if failed:
+            prompt_errors_total.inc("/process_prompts", amount=failed)
+        if trace is not None:
+            trace.args.update(
+                prompts=len(results), parsed=len(missing), failed=failed,
+                prompt_chars=sum(map(len, request.prompts)), max_prompt_chars=max(map(len, request.prompts), default=0),
+                clauses=sum(result["result"]["intent_count"] for result in results if result["status"] == "success"))
+            trace.returned = time.perf_counter()
+        if random.random() < LOG_SAMPLE_RATE:
+            logger.info("Processed prompts", extra={"fields": {
+                "endpoint": "/process_prompts", "ms": round(1000 * (time.perf_counter() - started), 3),
+                "batch_size": request.batch_size, "prompts": request.prompts, "results": results}})
+        return {"status": "success", "count": len(results), "results": results}
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
+        logger.error("Error processing prompts", extra={"fields": {
+            "endpoint": "/process_prompts", "prompts": len(request.prompts), "error": str(e)}})
         raise HTTPException(status_code=500, detail=str(e))
 
+# Endpoint to log raw prompts for training data
+@app.post("/log_prompt")
+async def log_prompt(request: PromptRequest):
+    new_data = {"prompt": request.prompt, "entities": [], "intent": None}
+    if not training_log_writer.submit(new_data):
+        raise HTTPException(status_code=503, detail="Training log queue is full")
+    return {"status": "logged"}
+
 # Endpoint to add annotated training data
 @app.post("/add_annotated_prompt")
 async def add_annotated_prompt(request: AnnotatedPrompt):
-    try:
-        new_data = {
-            "prompt": request.prompt,
-            "entities": request.entities,
-            "intent": request.intent
-        }
-        try:
-            with open("/home/oxunavailable/HAi Wallet/NLP/train_data.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = []
-        data.append(new_data)
-        with open("/home/oxunavailable/HAi Wallet/NLP/train_data.json", "w") as f:
-            json.dump(data, f, indent=2)
-        return {"status": "annotated prompt added"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    new_data = {
+        "prompt": request.prompt,
+        "entities": request.entities,
+        "intent": request.intent
+    }
+    if not training_log_writer.submit(new_data):
+        raise HTTPException(status_code=503, detail="Training log queue is full")
+    return {"status": "annotated prompt added"}
+
+# Training log write-behind queue stats
+@app.get("/log_queue_stats")
+async def log_queue_stats():
+    """Depth, throughput and drop counts of the training log write-behind queue"""
+    return training_log_writer.stats()
+
+# Micro-batching scheduler stats
+@app.get("/batching_stats")
+async def batching_stats():
+    """Queue depth, batch size distribution and added wait of the micro-batcher"""
+    return micro_batcher.stats()
+
+# Parsed-result cache stats
+@app.get("/cache_stats")
+async def cache_stats():
+    """Size, hit rate, evictions and expirations of the exact and skeleton caches"""
+    return {"exact": result_cache.stats(), "skeleton": skeleton_cache.stats()}
+
+# Fast path stats
+@app.get("/fast_path_stats")
+async def fast_path_stats():
+    """How often the regex fast path answered instead of the pipeline"""
+    return fast_parser.stats()
+
+# Prometheus metrics
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Request, pipeline stage, intent and model metrics in the Prometheus text format"""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+def require_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set NLP_ADMIN_TOKEN to enable them")
+    if token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+def profile_dump_path():
+    return os.path.join(PROFILE_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+
+def stage_summary():
+    """Docs and mean time per doc of each pipeline stage since startup, from the stage timers"""
+    return {
+        stage: {"docs": count, "mean_ms": round(1000 * total / count, 4) if count else None}
+        for (stage,), (count, total) in stage_duration.totals().items()
+    }
+
+# Sampled profiling of pipeline calls
+@app.get("/admin/profile")
+async def get_profile(sort: str = "cumulative", limit: int = 30, format: str = "json",
+                      x_admin_token: str | None = Header(default=None)):
+    """Aggregated cProfile stats of the sampled pipeline calls, plus per-stage timings"""
+    require_admin(x_admin_token)
+    if sort not in PROFILE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}")
+    if format == "text":
+        return Response(content=pipeline_profiler.text(sort, limit), media_type="text/plain")
+    return {**pipeline_profiler.summary(), "stages": stage_summary(), "functions": pipeline_profiler.top(sort, limit)}
+
+@app.post("/admin/profile")
+async def set_profile(settings: ProfileSettings, x_admin_token: str | None = Header(default=None)):
+    """Change the sampled fraction of pipeline calls (0 turns profiling off), optionally clearing the stats"""
+    require_admin(x_admin_token)
+    if settings.reset:
+        pipeline_profiler.reset()
+    pipeline_profiler.sample_rate = settings.sample_rate
+    logger.info("Profiling sample rate set to %s", settings.sample_rate)
+    return pipeline_profiler.summary()
+
+@app.post("/admin/profile/dump")
+async def dump_profile(x_admin_token: str | None = Header(default=None)):
+    """Write the aggregated stats to NLP_PROFILE_DIR in the pstats format"""
+    require_admin(x_admin_token)
+    path = profile_dump_path()
+    if not pipeline_profiler.dump(path):
+        raise HTTPException(status_code=404, detail="No calls have been profiled yet")
+    return {"path": path, **pipeline_profiler.summary()}
 
 # Home endpoint
 @app.get("/")
@@ -384,30 +1162,71 @@ async def home():
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        # Check if model can be loaded
-        model_path = os.path.join(os.path.dirname(__file__), "model", "model-best")
-        
-        if os.path.exists(model_path):
-            nlp = spacy.load(model_path)
-            model_status = "custom_model"
-        else:
-            nlp = spacy.load("en_core_web_sm")
-            model_status = "fallback_model"
-        
-        return {
-            "status": "healthy",
-            "timestamp": datetime.now().isoformat(),
-            "model_status": model_status,
-            "model_path": model_path if os.path.exists(model_path) else "fallback"
-        }
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "timestamp": datetime.now().isoformat(),
-            "error": str(e)
-        }
+    """Liveness: reports on the already loaded pipeline without touching the disk or the model loader"""
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "pid": os.getpid(),
+        "model_status": model_status,
+        "model_path": model_location,
+        "model_fingerprint": model_id,
+        "serving_mode": SERVING_MODE,
+        "pipeline": nlp.pipe_names,
+        "pool_size": pipeline_pool.size,
+        "pool_pending": pipeline_pool.pending,
+        "pool_rejected": pipeline_pool.rejected,
+        "loaded_at": loaded_at,
+        "load_time_s": round(load_time_s, 3),
+        "pipeline_source": pipeline_source,
+        "startup": startup_timer.summary(),
+        "warmed_up": pipeline_pool.warmed_up,
+        "latency": request_latency.summary()
+    }
+
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the model is loaded and every replica is warmed up, 503 before"""
+    if not pipeline_pool.warmed_up:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True}
+
+# Warm up the pipeline replicas in the background so /ready can report when it is done
+@app.on_event("startup")
+async def start_warm_up():
+    """Start background warm-up task"""
+    async def warm_up():
+        started = time.perf_counter()
+        try:
+            await pipeline_pool.warm_up(WARMUP_PROMPTS)
+            elapsed = time.perf_counter() - started
+            # Warm-up runs once the server is up, so it is timed on its own rather than from the last phase
+            startup_timer.phases["warm_up"] = elapsed
+            startup_timer.ready = time.perf_counter()
+            startup_phase_seconds.set(elapsed, "warm_up")
+            logger.info("Warmed up %d pipeline replicas in %.3fs, ready %.2fs after the first import",
+                        pipeline_pool.size, elapsed, startup_timer.ready - startup_timer.started)
+        except Exception as e:
+            logger.error("Pipeline warm-up failed: %s", str(e))
+
+    spawn(warm_up())
+
+# Start the training log writer, and flush it before the process exits
+@app.on_event("startup")
+async def start_training_log_writer():
+    training_log_writer.start()
+
+@app.on_event("shutdown")
+async def stop_training_log_writer():
+    await training_log_writer.stop()
+    logger.info("Flushed training log: %s", training_log_writer.stats())
+
+# Keep whatever was profiled when the process exits
+@app.on_event("shutdown")
+async def dump_profile_on_shutdown():
+    path = profile_dump_path()
+    if pipeline_profiler.dump(path):
+        logger.info("Wrote profile of %d sampled pipeline calls to %s", pipeline_profiler.sampled, path)
 
 # Background task to call main API health endpoint every minute
 @app.on_event("startup")
@@ -436,6 +1255,13 @@ async def start_health_check():
             await asyncio.sleep(60)
     
     # Start the background task
-    asyncio.create_task(health_check_loop())
+    spawn(health_check_loop())
+
+# Everything after the pipeline is built: caches, fast path, metrics and routes
+startup_timer.phase("service")
+for phase, seconds in startup_timer.phases.items():
+    startup_phase_seconds.set(seconds, phase)
+logger.info("Loaded the service in %.0f ms", 1000 * (startup_timer.last - startup_timer.started),
+            extra={"fields": {"pipeline_source": pipeline_source, **startup_timer.summary()}})
 
 # Run with: uvicorn nlp_service:app --host 0.0.0.0 --port 8000
\ No newline at end of file
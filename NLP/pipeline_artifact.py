@@ -0,0 +1,103 @@
+"""
+Serialized serving pipeline: the loaded model with our components added, in one file
+
+Building the pipeline means resolving the model's config, constructing every
+component, reading its weights and tokenizer exceptions, then compiling the
+intent_parameters patterns. The artifact stores the finished pipeline as one
+pickle, so a cold start only unpickles it. It is keyed by everything the
+pipeline is built from (model files, spaCy version, serving mode, patterns);
+when any of them changes the artifact no longer matches and the service builds
+the pipeline the usual way and rewrites it.
+
+The artifact is a pickle: only load files this service wrote.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Bump when the file layout or the pickled objects change incompatibly
+FORMAT_VERSION = 1
+
+# It is a cache, kept in .cache/ rather than next to the model it was built from
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+
+def configured_path(serving_mode):
+    """NLP_PIPELINE_ARTIFACT, by default .cache/pipeline-<serving_mode>.pkl; empty if the artifact is disabled"""
+    return os.environ.get("NLP_PIPELINE_ARTIFACT", os.path.join(DEFAULT_DIR, f"pipeline-{serving_mode}.pkl"))
+
+
+def directory_digest(path):
+    """sha256 of the relative paths and contents of every file under path, or None if it does not exist"""
+    if not os.path.isdir(path):
+        return None
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            full_path = os.path.join(root, filename)
+            digest.update(os.path.relpath(full_path, path).encode("utf-8") + b"\0")
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def artifact_key(**inputs):
+    """Digest of the inputs a pipeline is built from; an artifact is used only if its key matches"""
+    inputs["format"] = FORMAT_VERSION
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load(path, key):
+    """Load the artifact at path: (info, pipeline, payload) if it was built for key, else None.
+
+    info is the dict passed to save(); pickle.loads(payload) gives another copy
+    of the pipeline each time it is called.
+    """
+    try:
+        with open(path, "rb") as f:
+            info = pickle.load(f)
+            if info.get("key") != key:
+                logger.info("Pipeline artifact %s is out of date, loading the model instead", path)
+                return None
+            payload = f.read()
+        return info, pickle.loads(payload), payload
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Failed to load pipeline artifact %s, loading the model instead: %s", path, str(e))
+        return None
+
+
+def save(path, pipeline, key, info):
+    """Write pipeline to path with info (plus key) in front of it.
+
+    The file is written next to path and renamed into place, so a worker
+    starting at the same time reads either the old artifact or the new one.
+    Returns the payload size in bytes.
+    """
+    payload = pickle.dumps(pipeline, protocol=pickle.HIGHEST_PROTOCOL)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(dict(info, key=key), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(payload)
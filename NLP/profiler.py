@@ -0,0 +1,118 @@
+"""
+Sampled cProfile of pipeline calls, aggregated in memory
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+
+
+class SampledProfiler:
+    """Runs a fraction of calls under cProfile and merges their stats.
+
+    sample_rate can be changed at any time; 0 turns profiling off and costs one
+    comparison per call. Only one call is profiled at a time (cProfile cannot
+    run two profilers at once on Python 3.12+), so a sample that would overlap
+    another is skipped and counted.
+    """
+
+    def __init__(self, sample_rate=0.0):
+        self.sample_rate = sample_rate
+        self.active = threading.Lock()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = None
+            self.calls = 0
+            self.sampled = 0
+            self.skipped = 0
+            self.profiled_s = 0.0
+            self.since = time.time()
+
+    def call(self, fn, *args):
+        """Return fn(*args), profiling the call if it is sampled"""
+        if self.sample_rate <= 0:
+            return fn(*args)
+        with self.lock:
+            self.calls += 1
+        if random.random() >= self.sample_rate:
+            return fn(*args)
+        if not self.active.acquire(blocking=False):
+            with self.lock:
+                self.skipped += 1
+            return fn(*args)
+        try:
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            try:
+                return profile.runcall(fn, *args)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.add(profile, elapsed)
+        finally:
+            self.active.release()
+
+    def add(self, profile, elapsed):
+        profile.create_stats()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.sampled += 1
+            self.profiled_s += elapsed
+
+    def top(self, sort="cumulative", limit=30):
+        """The limit most expensive functions by sort ("cumulative", "tottime" or "ncalls")"""
+        with self.lock:
+            if self.stats is None:
+                return []
+            stats = self.stats.stats
+            keys = {"cumulative": 3, "tottime": 2, "ncalls": 1}
+            index = keys[sort]
+            ranked = sorted(stats.items(), key=lambda item: item[1][index], reverse=True)[:limit]
+        return [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})" if line else name,
+                "ncalls": ncalls,
+                "tottime_s": round(tottime, 6),
+                "cumtime_s": round(cumtime, 6),
+                "percall_ms": round(1000 * cumtime / ncalls, 4) if ncalls else None,
+            }
+            for (filename, line, name), (_, ncalls, tottime, cumtime, _) in ranked
+        ]
+
+    def text(self, sort="cumulative", limit=30):
+        """pstats' own report of the limit most expensive functions"""
+        with self.lock:
+            if self.stats is None:
+                return ""
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self, path):
+        """Write the aggregated stats to path in the pstats format (readable by pstats, snakeviz, ...)"""
+        with self.lock:
+            if self.stats is None:
+                return False
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.stats.dump_stats(path)
+        return True
+
+    def summary(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.since)),
+            "calls": self.calls,
+            "sampled": self.sampled,
+            "skipped": self.skipped,
+            "profiled_s": round(self.profiled_s, 3),
+        }
@@ -0,0 +1,92 @@
+"""
+Bounded LRU cache for parsed prompt results
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """Collapse runs of whitespace and strip the ends, so trivially different prompts share a key"""
+    return " ".join(prompt.split())
+
+
+class PromptCache:
+    """Thread-safe LRU cache with optional TTL and hit/miss/eviction counters.
+
+    Values are stored serialized, so every get returns a fresh copy and callers
+    can never mutate a cached result.
+    """
+
+    def __init__(self, max_size=4096, ttl=None, version=None):
+        self.max_size = max_size
+        self.ttl = ttl or None
+        self.version = version
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def key(self, prompt):
+        return (self.version, prompt)
+
+    def get(self, prompt):
+        """Return a copy of the cached result for an already normalized prompt, or None"""
+        if not self.enabled:
+            return None
+        key = self.key(prompt)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, payload = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(payload)
+
+    def put(self, prompt, result):
+        """Store a copy of result for an already normalized prompt"""
+        if not self.enabled:
+            return
+        key = self.key(prompt)
+        payload = json.dumps(result)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "version": self.version,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Preforking launcher: loads the NLP service once, then forks uvicorn workers that share it
+
+The service module, with its pipeline replicas, vocab and model weights, is
+imported in this process before any worker exists. Each worker is a fork of it,
+so all of them start from the same memory pages and the kernel only copies a
+page when a worker writes to it (copy-on-write). The workers accept
+connections from one listening socket, and a worker that exits is replaced by
+a new fork, which starts with the model already loaded.
+
+Every --memory-report-interval seconds (and on SIGUSR1) the parent logs the
+memory of each worker: RSS, PSS, the pages only that worker holds (unique) and
+the pages it shares with the parent and the other workers (shared). Each
+additional worker costs about its unique memory; the PSS total is what the
+whole group uses. The report reads /proc/<pid>/smaps_rollup, so it needs Linux.
+
+Usage:
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+    python serve.py --workers 4 --memory-report-interval 60
+    kill -USR1 <parent pid>   # log a memory report now
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+logger = logging.getLogger("serve")
+
+# smaps_rollup fields reported, in kB
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def process_memory(pid="self"):
+    """RSS, PSS, unique (private) and shared memory of a process in MB, or None if /proc is unavailable"""
+    totals = dict.fromkeys(MEMORY_FIELDS, 0)
+    for name in ("smaps_rollup", "smaps"):
+        try:
+            with open(f"/proc/{pid}/{name}") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in totals and value.endswith("kB\n"):
+                        totals[key] += int(value.split()[0])
+            break
+        except FileNotFoundError:
+            continue
+        except OSError:
+            return None
+    else:
+        return None
+    return {
+        "rss_mb": round(totals["Rss"] / 1024, 1),
+        "pss_mb": round(totals["Pss"] / 1024, 1),
+        "unique_mb": round((totals["Private_Clean"] + totals["Private_Dirty"]) / 1024, 1),
+        "shared_mb": round((totals["Shared_Clean"] + totals["Shared_Dirty"]) / 1024, 1),
+        "swap_mb": round(totals["Swap"] / 1024, 1),
+    }
+
+
+def memory_report(parent_pid, worker_pids):
+    """Memory of the parent and each worker, with the group's PSS total and the mean unique memory per worker"""
+    parent = process_memory(parent_pid)
+    workers = []
+    for pid in worker_pids:
+        memory = process_memory(pid)
+        if memory is not None:
+            workers.append({"pid": pid, **memory})
+    if parent is None:
+        return None
+    return {
+        "parent": parent,
+        "workers": workers,
+        "total_pss_mb": round(parent["pss_mb"] + sum(worker["pss_mb"] for worker in workers), 1),
+        "mean_worker_unique_mb": round(sum(worker["unique_mb"] for worker in workers) / len(workers), 1)
+        if workers else None,
+    }
+
+
+def bind_socket(host, port, backlog=2048):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks the workers from the preloaded parent, replaces workers that exit and stops them on SIGTERM/SIGINT"""
+
+    def __init__(self, config, log_handler, sock, args):
+        self.config = config
+        self.log_handler = log_handler
+        self.sock = sock
+        self.args = args
+        # pid -> (worker number, monotonic start time)
+        self.workers = {}
+        self.stopping = False
+        self.report_requested = False
+
+    def spawn(self, number):
+        pid = os.fork()
+        if pid == 0:
+            self.run_worker(number)
+        self.workers[pid] = (number, time.monotonic())
+        logger.info("Started worker %d (pid %d)", number, pid)
+
+    def run_worker(self, number):
+        """Serve the shared socket in this forked child until uvicorn exits, then exit the process"""
+        code = 1
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+                signal.signal(signum, signal.SIG_DFL)
+            uvicorn.Server(self.config).run(sockets=[self.sock])
+            code = 0
+        except BaseException:
+            logger.exception("Worker %d (pid %d) failed", number, os.getpid())
+        finally:
+            # Skip the parent's cleanup further up the stack: write out queued log records and exit here
+            self.log_handler.listener.stop()
+            os._exit(code)
+
+    def reap(self):
+        """Collect workers that exited; replace them unless shutting down"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            number, started = self.workers.pop(pid, (None, None))
+            if number is None:
+                continue
+            if self.stopping:
+                continue
+            logger.warning("Worker %d (pid %d) exited with status %d after %.1fs, replacing it", number, pid,
+                           os.waitstatus_to_exitcode(status), time.monotonic() - started)
+            # A worker that dies straight away would otherwise be re-forked in a tight loop
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            self.spawn(number)
+
+    def report(self):
+        report = memory_report(os.getpid(), sorted(self.workers))
+        if report is None:
+            logger.warning("Memory report unavailable: /proc/<pid>/smaps_rollup cannot be read on this system")
+            return
+        logger.info("Worker memory: %d workers, %.1f MB PSS in total, %.1f MB unique per worker",
+                    len(report["workers"]), report["total_pss_mb"], report["mean_worker_unique_mb"] or 0,
+                    extra={"fields": report})
+
+    def run(self):
+        def stop(signum, frame):
+            self.stopping = True
+
+        def request_report(signum, frame):
+            self.report_requested = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGUSR1, request_report)
+
+        # Keep the collector from touching (and so copying) every preloaded object in each worker
+        gc.collect()
+        gc.freeze()
+        for number in range(1, self.args.workers + 1):
+            self.spawn(number)
+        logger.info("Serving on %s:%d with %d workers (parent pid %d)", self.args.host, self.args.port,
+                    self.args.workers, os.getpid())
+
+        interval = self.args.memory_report_interval
+        next_report = time.monotonic() + interval if interval > 0 else None
+        while not self.stopping:
+            self.reap()
+            if self.report_requested or (next_report is not None and time.monotonic() >= next_report):
+                self.report_requested = False
+                self.report()
+                if next_report is not None:
+                    next_report = time.monotonic() + interval
+            time.sleep(0.2)
+        self.shutdown()
+
+    def shutdown(self):
+        """SIGTERM every worker, wait for them to finish in-flight requests, then SIGKILL what is left"""
+        logger.info("Stopping %d workers", len(self.workers))
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # uvicorn's own graceful timeout, plus time for its shutdown handlers
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid, (number, _) in list(self.workers.items()):
+            logger.warning("Worker %d (pid %d) did not stop in time, killing it", number, pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+                        help="worker processes (default: WEB_CONCURRENCY, else one per CPU)")
+    parser.add_argument("--memory-report-interval", type=float, default=300,
+                        help="seconds between memory reports; 0 reports only on SIGUSR1 (default: 300)")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="seconds a stopping worker may spend finishing requests (default: 30)")
+    parser.add_argument("--log-level", default="info", help="uvicorn log level (default: info)")
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        parser.error("serve.py needs os.fork(); run `uvicorn nlp_service:app` on this platform")
+    args.workers = max(1, args.workers)
+
+    # Bind before loading, so a port in use fails fast
+    sock = bind_socket(args.host, args.port)
+    sys.path.insert(0, current_dir)
+    import nlp_service
+
+    # Load uvicorn's protocol and lifespan modules here too, so the workers share them
+    config = uvicorn.Config(nlp_service.app, log_level=args.log_level, timeout_graceful_shutdown=args.graceful_timeout)
+    config.load()
+    Supervisor(config, nlp_service.log_handler, sock, args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Template-level parse cache keyed by prompt skeletons
+
+A skeleton is the prompt with its variable parts replaced by slot placeholders,
+e.g. "send 0.5 ETH to 0x90...5ee on Base" -> "send <NUM> ETH to <ADDR> on Base".
+Prompts that share a skeleton parse to the same structure, so once a skeleton
+has a template the result for any prompt with that skeleton is built by filling
+in its slot values, without running the pipeline.
+"""
+
+import re
+
+from prompt_cache import PromptCache
+
+NUM_RE = re.compile(r"[0-9]+(?:\.[0-9]+)?")
+ADDR_RE = re.compile(r"0x[a-fA-F0-9]{40}")
+NAME_RE = re.compile(r"[A-Za-z]+")
+
+# Words that introduce a recipient name
+NAME_PREFIXES = {"to", "for"}
+
+# Every word the intent_parameters patterns react to. A "name" in this set is
+# part of the grammar, not a free slot.
+KEYWORDS = {
+    "eth", "usdc", "ethereum", "base", "optimism", "mainnet", "testnet",
+    "to", "for", "from", "on", "via", "through", "bridge", "execute",
+    "send", "transfer", "move", "swap", "check", "get", "query", "show",
+    "balance", "amount", "user",
+}
+
+# Punctuation that may trail a slot value and is split off by the tokenizer
+TRAILING_PUNCT = ",.;:!?"
+
+# Sentinel values used to learn a template. They behave like any other value
+# of their slot type under the matcher patterns but are distinct from each other.
+SENTINELS = {
+    "<NUM>": lambda i: str(7770001 + i),
+    "<ADDR>": lambda i: "0x" + format(0xA11CE000 + i, "040x"),
+    "<NAME>": lambda i: "Zzslot" + "".join(chr(ord("a") + int(d)) for d in str(i)),
+}
+
+# Marker for a slot reference inside a stored template
+SLOT_KEY = "$slot"
+
+
+class SkeletonCache:
+    """LRU of result templates keyed by prompt skeleton.
+
+    The tokenizer is used to check that every slot value is a single token in
+    context, so replacing it with another value cannot change tokenization.
+    It must not be shared with a pipeline running on another thread.
+    """
+
+    def __init__(self, tokenizer, max_size=1024, ttl=None, version=None):
+        self.tokenizer = tokenizer
+        self.templates = PromptCache(max_size=max_size, ttl=ttl, version=version)
+        self.pending = set()
+        self.learned = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return self.templates.enabled
+
+    def classify(self, core, previous):
+        if ADDR_RE.fullmatch(core):
+            return "<ADDR>"
+        if NUM_RE.fullmatch(core):
+            return "<NUM>"
+        if (previous in NAME_PREFIXES and NAME_RE.fullmatch(core)
+                and core.lower() not in KEYWORDS and core not in self.tokenizer.rules):
+            return "<NAME>"
+        return None
+
+    def split(self, prompt):
+        """Return (skeleton, [(slot, value), ...]) for a normalized prompt, or None if it has no slots"""
+        words = prompt.split(" ")
+        slots = []
+        previous = None
+        for i, word in enumerate(words):
+            core, punct = word, ""
+            if len(word) > 1 and word[-1] in TRAILING_PUNCT:
+                core, punct = word[:-1], word[-1]
+            slot = self.classify(core, previous)
+            previous = core.lower()
+            if slot is None:
+                continue
+            expected = [core, punct] if punct else [core]
+            if [t.text for t in self.tokenizer(word)] != expected:
+                continue
+            words[i] = slot + punct
+            slots.append((slot, core))
+        if not slots:
+            return None
+        return " ".join(words), slots
+
+    def lookup(self, prompt):
+        """Build the result for prompt from its skeleton's template, or return None"""
+        if not self.enabled:
+            return None
+        split = self.split(prompt)
+        if split is None:
+            return None
+        skeleton, slots = split
+        if has_repeats(slots):
+            return None
+        template = self.templates.get(skeleton)
+        if template is None or template.get("uncacheable"):
+            return None
+        return fill(template["result"], [value for _, value in slots])
+
+    def probe_for(self, prompt):
+        """Return the sentinel prompt to parse to learn prompt's template, or None if not needed"""
+        if not self.enabled:
+            return None
+        split = self.split(prompt)
+        if split is None:
+            return None
+        skeleton, slots = split
+        if has_repeats(slots) or skeleton in self.pending or skeleton in self:
+            return None
+        self.pending.add(skeleton)
+        return render(skeleton, [sentinel(slot, i) for i, (slot, _) in enumerate(slots)])
+
+    def learn(self, prompt, result, probe_result):
+        """Store the template derived from probe_result if it reproduces prompt's real result"""
+        skeleton, slots = self.split(prompt)
+        self.pending.discard(skeleton)
+        sentinels = {sentinel(slot, i): i for i, (slot, _) in enumerate(slots)}
+        template = abstract(probe_result, sentinels)
+        if template is None or fill(template, [value for _, value in slots]) != result:
+            self.rejected += 1
+            self.templates.put(skeleton, {"uncacheable": True})
+            return False
+        self.learned += 1
+        self.templates.put(skeleton, {"result": template})
+        return True
+
+    def forget(self, prompt):
+        """Drop a pending probe for prompt, e.g. after the probe failed to parse"""
+        split = self.split(prompt)
+        if split is not None:
+            self.pending.discard(split[0])
+
+    def __contains__(self, skeleton):
+        return self.templates.key(skeleton) in self.templates.entries
+
+    def stats(self):
+        stats = self.templates.stats()
+        stats.update({"templates_learned": self.learned, "skeletons_rejected": self.rejected, "pending": len(self.pending)})
+        return stats
+
+
+def has_repeats(slots):
+    """True if two slots of the same kind hold the same value.
+
+    Templates are learned from sentinels that are all distinct, but the
+    pipeline merges repeated values (e.g. duplicate amount and token pairs), so
+    a prompt that repeats a value may parse to a different structure and has to
+    go through the pipeline.
+    """
+    seen = set()
+    for slot, value in slots:
+        key = (slot, float(value) if slot == "<NUM>" else value.lower())
+        if key in seen:
+            return True
+        seen.add(key)
+    return False
+
+
+def sentinel(slot, index):
+    return SENTINELS[slot](index)
+
+
+def render(skeleton, values):
+    """Substitute values for the slot placeholders of a skeleton, in order"""
+    values = iter(values)
+    return re.sub(r"<NUM>|<ADDR>|<NAME>", lambda m: next(values), skeleton)
+
+
+def abstract(value, sentinels):
+    """Replace sentinel strings in a parsed result with slot markers.
+
+    Returns None if a sentinel only appears as part of a longer string, since
+    such a template could not be filled reliably.
+    """
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            v = abstract(v, sentinels)
+            if v is None and value[k] is not None:
+                return None
+            out[k] = v
+        return out
+    if isinstance(value, list):
+        out = []
+        for item in value:
+            v = abstract(item, sentinels)
+            if v is None and item is not None:
+                return None
+            out.append(v)
+        return out
+    if isinstance(value, str):
+        if value in sentinels:
+            return {SLOT_KEY: sentinels[value]}
+        if any(s in value for s in sentinels):
+            return None
+    return value
+
+
+def fill(template, values):
+    """Replace slot markers in a template with the prompt's slot values"""
+    if isinstance(template, dict):
+        if SLOT_KEY in template and len(template) == 1:
+            return values[template[SLOT_KEY]]
+        return {k: fill(v, values) for k, v in template.items()}
+    if isinstance(template, list):
+        return [fill(item, values) for item in template]
+    return template
@@ -4,19 +4,22 @@ Startup script for NLP service deployment
 This script ensures all dependencies are properly installed and the service starts correctly
 """
 
+import argparse
+import importlib.util
 import subprocess
 import sys
 import os
 
+# Files spacy.load() needs in a model directory
+MODEL_FILES = ["config.cfg", "meta.json"]
+
 def download_spacy_model():
     """Download the spaCy English model if not already present"""
-    try:
-        import spacy
-        # Try to load the model
-        nlp = spacy.load("en_core_web_sm")
+    # Look the package up instead of loading it: importing spaCy and loading a model takes seconds
+    if importlib.util.find_spec("en_core_web_sm") is not None:
         print("✓ spaCy English model already available")
         return True
-    except OSError:
+    else:
         print("Downloading spaCy English model...")
         try:
             subprocess.run([sys.executable, "-m", "spacy", "download", "en_core_web_sm"], 
@@ -32,15 +35,50 @@ def check_model_files():
     current_dir = os.path.dirname(os.path.abspath(__file__))
     model_path = os.path.join(current_dir, "model", "model-best")
     
-    if os.path.exists(model_path):
+    missing = [name for name in MODEL_FILES if not os.path.isfile(os.path.join(model_path, name))]
+    if os.path.isdir(model_path) and not missing:
         print(f"✓ Custom model found at: {model_path}")
         return True
+    elif os.path.isdir(model_path):
+        print(f"⚠ Custom model at {model_path} is missing {', '.join(missing)}")
+        print("  Will use fallback spaCy model")
+        return False
     else:
         print(f"⚠ Custom model not found at: {model_path}")
         print("  Will use fallback spaCy model")
         return False
 
-def main():
+def check_pipeline_artifact():
+    """Report whether the serialized serving pipeline is present (nlp_service checks that it matches)"""
+    # The path nlp_service uses, without importing it: that would load the model and write the artifact
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import pipeline_artifact
+    path = pipeline_artifact.configured_path(os.environ.get("NLP_SERVING_MODE", "full"))
+    if not path:
+        print("⚠ Pipeline artifact disabled (NLP_PIPELINE_ARTIFACT is empty)")
+        return False
+    if os.path.isfile(path):
+        print(f"✓ Pipeline artifact found at: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+        return True
+    print(f"⚠ Pipeline artifact not found at: {path}")
+    print("  The first start will load the model and write it; run `python startup.py --build-artifact` to build it now")
+    return False
+
+def build_pipeline_artifact():
+    """Build the pipeline artifact the way the service does on startup, without serving"""
+    os.environ.setdefault("NLP_POOL_SIZE", "1")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import nlp_service
+    if nlp_service.pipeline_source == "artifact":
+        print(f"✓ Pipeline artifact at {nlp_service.PIPELINE_ARTIFACT} is up to date")
+    elif nlp_service.artifact_written:
+        print(f"✓ Built pipeline artifact at {nlp_service.PIPELINE_ARTIFACT}")
+    else:
+        print(f"✗ Pipeline artifact not written (model: {nlp_service.model_status})")
+        return False
+    return True
+
+def main(build_artifact=False):
     """Main startup function"""
     print("🚀 Starting NLP Service...")
     
@@ -50,9 +88,17 @@ def main():
     
     # Check for custom model
     check_model_files()
+
+    if build_artifact:
+        build_pipeline_artifact()
+    else:
+        check_pipeline_artifact()
     
     print("✅ Startup checks completed")
     print("📝 Service will start with uvicorn...")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--build-artifact", action="store_true",
+                        help="load the model once and write the pipeline artifact (e.g. while building an image)")
+    main(build_artifact=parser.parse_args().build_artifact) 
\ No newline at end of file
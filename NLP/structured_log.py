@@ -0,0 +1,143 @@
+"""
+Queue-based logging with compact structured lines
+
+Handlers on the request path only put records on a bounded in-memory queue; a
+listener thread formats them and writes them to stderr. Structured fields are
+passed as logger.info("message", extra={"fields": {...}}) and rendered as one
+JSON object per line (or appended to a text line).
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any structured fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The usual "LEVEL:logger:message" line, with structured fields appended as compact JSON"""
+
+    def format(self, record):
+        line = f"{record.levelname}:{record.name}:{record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + json.dumps(fields, separators=(",", ":"), default=str)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records that do not fit in the queue are dropped and counted.
+
+    Formatting is left to the listener thread. Only the %-style message and any
+    traceback are rendered here, so later changes to the arguments cannot leak
+    into the record.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Other handlers of the logger get the same record, so change a copy
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Listener(logging.handlers.QueueListener):
+    """QueueListener that can be stopped when it is not running"""
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def stop(self):
+        if self.running:
+            super().stop()
+
+
+# The listener of the last setup_logging call, and whether the fork hooks stopped it
+listener = None
+paused = False
+
+
+def stop_listener():
+    if listener is not None:
+        listener.stop()
+
+
+def before_fork():
+    # A forked child inherits the queue but not the listener thread, and could inherit the queue's lock
+    # held: stop the listener (writing out what is queued) before a fork and start it again on both sides
+    global paused
+    paused = listener is not None and listener.running
+    if paused:
+        listener.stop()
+
+
+def after_fork():
+    if paused:
+        listener.start()
+
+
+atexit.register(stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=before_fork, after_in_parent=after_fork, after_in_child=after_fork)
+
+
+def setup_logging(level="INFO", fmt="json", max_queue=10000, stream=None):
+    """Route the root logger through a bounded queue to a stderr handler on a listener thread.
+
+    Returns the queue handler (for its drop count; its listener attribute is the
+    listener thread). A listener from an earlier call is stopped. Records still
+    queued are written when the interpreter exits.
+    """
+    global listener
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=max_queue))
+    queue_handler.listener = Listener(queue_handler.queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    stop_listener()
+    listener = queue_handler.listener
+    listener.start()
+    return queue_handler
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Latency-aware sweep over NER network sizes
+
+Every combination of the given HashEmbedCNN width, depth and embed_size and
+parser hidden width is trained with train_model.train_minibatch, in parallel
+across worker processes. Once all variants are trained, each model-best is
+scored on the dev set, timed on one prompt at a time, one variant after the
+other so the timings do not compete for CPU, and measured on disk. The report
+marks the variants on the Pareto front of dev F-score, latency and size, and
+--promote copies the best variant within --latency-budget-ms to
+model/model-best.
+
+Usage:
+    python sweep.py                                         # default grid, one worker per CPU
+    python sweep.py --width 32 64 96 --depth 2 4 --workers 4
+    python sweep.py --latency-budget-ms 0.5 --promote
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import spacy
+
+from corpus import ShardedCorpus
+from train_model import (BASE_MODEL_PATH, DEFAULT_ARCHITECTURE, DEV_PATH, SHARD_DIR, TRAIN_DATA_PATH, evaluate,
+                         load_examples, train_minibatch)
+from training_store import load_dataset
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SWEEP_DIR = os.path.join(current_dir, "sweeps")
+
+
+def variant_name(architecture):
+    return "w{width}-d{depth}-e{embed_size}-h{hidden_width}".format(**architecture)
+
+
+def train_variant(architecture, output_dir, seed):
+    """Train one variant into output_dir, logging to output_dir/train.log"""
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    with open(os.path.join(output_dir, "train.log"), "w") as log, contextlib.redirect_stdout(log):
+        report = train_minibatch(ShardedCorpus(SHARD_DIR), output_dir, seed=seed, architecture=architecture)
+    report["train_time_s"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def directory_size_mb(path):
+    total = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return round(total / 2**20, 3)
+
+
+def measure(model_dir, prompts, repeat=3):
+    """Dev scores, single-prompt latency and disk size of a trained model"""
+    nlp = spacy.load(model_dir)
+    result = evaluate(nlp, load_examples(nlp, DEV_PATH))
+    for prompt in prompts[:20]:
+        nlp(prompt)
+    samples = []
+    for _ in range(repeat):
+        for prompt in prompts:
+            start = time.perf_counter()
+            nlp(prompt)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    result["p50_ms"] = round(statistics.median(samples), 4)
+    result["p95_ms"] = round(samples[int(len(samples) * 0.95)], 4)
+    result["size_mb"] = directory_size_mb(model_dir)
+    return result
+
+
+def dominates(a, b):
+    """a is at least as good as b on F-score, p50 latency and size, and better on one of them"""
+    return (a["ents_f"] >= b["ents_f"] and a["p50_ms"] <= b["p50_ms"] and a["size_mb"] <= b["size_mb"]
+            and (a["ents_f"] > b["ents_f"] or a["p50_ms"] < b["p50_ms"] or a["size_mb"] < b["size_mb"]))
+
+
+def pareto_front(results):
+    """Mark the results that no other result dominates"""
+    for result in results:
+        result["pareto"] = not any(dominates(other, result) for other in results)
+    return results
+
+
+def choose(results, latency_budget_ms=None):
+    """Highest dev F-score within the latency budget; ties go to the faster variant"""
+    eligible = [r for r in results if latency_budget_ms is None or r["p50_ms"] <= latency_budget_ms]
+    return max(eligible, key=lambda r: (r["ents_f"], -r["p50_ms"]), default=None)
+
+
+def promote(model_dir, target=BASE_MODEL_PATH):
+    """Copy model_dir to target, keeping the model it replaces as target.prev"""
+    tmp_dir = target + ".tmp"
+    previous = target + ".prev"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.copytree(model_dir, tmp_dir)
+    if os.path.exists(target):
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(target, previous)
+    os.rename(tmp_dir, target)
+
+
+def sweep(architectures, output_dir, workers=None, seed=0, repeat=3):
+    ShardedCorpus(SHARD_DIR).update(TRAIN_DATA_PATH)
+    os.makedirs(output_dir, exist_ok=True)
+    names = [variant_name(architecture) for architecture in architectures]
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        reports = list(executor.map(train_variant, architectures,
+                                    [os.path.join(output_dir, name) for name in names], [seed] * len(names)))
+
+    prompts = [record["prompt"] for record in load_dataset(TRAIN_DATA_PATH)]
+    results = []
+    for name, architecture, report in zip(names, architectures, reports):
+        result = {"name": name, **architecture, "epochs": report["epochs"], "train_time_s": report["train_time_s"]}
+        result.update(measure(os.path.join(output_dir, name, "model-best"), prompts, repeat))
+        results.append(result)
+        print(json.dumps(result))
+    results.sort(key=lambda r: (-r["ents_f"], r["p50_ms"]))
+    return pareto_front(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, nargs="+", default=[32, 64, 96])
+    parser.add_argument("--depth", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--embed-size", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--hidden-width", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Variants trained at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over train_data.json per variant")
+    parser.add_argument("--output-dir", default=DEFAULT_SWEEP_DIR, help="Where variants and report.json are written")
+    parser.add_argument("--latency-budget-ms", type=float, help="Only promote variants at or under this p50 latency")
+    parser.add_argument("--promote", action="store_true", help="Copy the chosen variant to model/model-best")
+    args = parser.parse_args()
+
+    architectures = [
+        {"width": width, "depth": depth, "embed_size": embed_size, "hidden_width": hidden_width}
+        for width, depth, embed_size, hidden_width in itertools.product(args.width, args.depth, args.embed_size, args.hidden_width)
+    ]
+    results = sweep(architectures, args.output_dir, args.workers, args.seed, args.repeat)
+    best = choose(results, args.latency_budget_ms)
+    report = {
+        "baseline": variant_name(DEFAULT_ARCHITECTURE),
+        "latency_budget_ms": args.latency_budget_ms,
+        "chosen": best["name"] if best else None,
+        "promoted": False,
+        "results": results,
+    }
+    if best is None:
+        print(f"No variant within {args.latency_budget_ms} ms")
+    elif args.promote:
+        promote(os.path.join(args.output_dir, best["name"], "model-best"))
+        report["promoted"] = True
+        print(f"Promoted {best['name']} to {BASE_MODEL_PATH}")
+    with open(os.path.join(args.output_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'variant':<22} {'ents_f':>7} {'p50_ms':>8} {'p95_ms':>8} {'size_mb':>8}  pareto")
+    for r in results:
+        print(f"{r['name']:<22} {r['ents_f']:>7.4f} {r['p50_ms']:>8.4f} {r['p95_ms']:>8.4f} {r['size_mb']:>8.3f}  {'*' if r['pareto'] else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def service(tmp_path_factory):
+    """nlp_service with one replica, writing nothing into the source tree"""
+    workdir = tmp_path_factory.mktemp("service")
+    os.environ.update({
+        "NLP_POOL_SIZE": "1",
+        "NLP_LOG_LEVEL": "WARNING",
+        "NLP_PIPELINE_ARTIFACT": "",
+        "NLP_SLOW_LOG": "",
+        "NLP_TRAIN_LOG": str(workdir / "train_data.jsonl"),
+        "NLP_PROFILE_DIR": str(workdir / "profiles"),
+    })
+    import nlp_service
+    return nlp_service
+
+
+@pytest.fixture
+def parse(service):
+    """Parse a prompt with the full pipeline, as /process_prompt does on a cache miss"""
+    def parse(prompt):
+        return service.parse_prompt(service.nlp, service.normalize_prompt(prompt))
+    return parse
@@ -0,0 +1,20 @@
+import asyncio
+import logging
+
+
+def test_spawned_tasks_are_kept_until_done_and_failures_are_logged(service, caplog):
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def main():
+        task = service.spawn(fail())
+        assert task in service.background_tasks
+        await asyncio.wait([task])
+        await asyncio.sleep(0)
+        return task
+
+    with caplog.at_level(logging.ERROR, logger="nlp_service"):
+        task = asyncio.run(main())
+    assert task not in service.background_tasks
+    assert "Background task" in caplog.text and "ValueError: boom" in caplog.text
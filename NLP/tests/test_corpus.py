@@ -0,0 +1,82 @@
+import json
+
+import pytest
+import spacy
+
+from corpus import ShardedCorpus, iter_records
+
+
+def record(i, prompt="Send {} ETH to Bob"):
+    prompt = prompt.format(i)
+    start = prompt.index(str(i))
+    return {"prompt": prompt, "entities": [{"start": start, "end": start + len(str(i)), "label": "AMOUNT"}]}
+
+
+def prompts(corpus):
+    return sorted(doc.text for doc in corpus.docs(spacy.blank("en").vocab))
+
+
+@pytest.mark.parametrize("layout", ["array", "lines"])
+def test_iter_records_streams_both_layouts(tmp_path, layout):
+    records = [record(i) for i in range(50)]
+    path = tmp_path / "data"
+    if layout == "array":
+        path.write_text(json.dumps(records, indent=2))
+    else:
+        path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    # A small chunk size makes records straddle reads
+    assert list(iter_records(str(path), chunk_size=64)) == records
+
+
+def test_update_converts_only_new_records(tmp_path):
+    corpus = ShardedCorpus(str(tmp_path / "shards"), shard_size=4, workers=1)
+    records = [record(i) for i in range(10)]
+    report = corpus.update(records)
+    assert (report["records"], report["converted"], report["shards"]) == (10, 10, 3)
+
+    report = corpus.update(records + [record(10)])
+    assert (report["converted"], report["reused"], report["shards"]) == (1, 10, 4)
+    assert len(corpus) == 11
+    assert prompts(corpus) == sorted(r["prompt"] for r in records + [record(10)])
+
+
+def test_docs_follow_duplicates_and_removals(tmp_path):
+    corpus = ShardedCorpus(str(tmp_path / "shards"), shard_size=4, workers=1)
+    records = [record(i) for i in range(8)]
+    corpus.update(records)
+
+    current = records[:6] + [record(0)]
+    report = corpus.update(current)
+    assert report["converted"] == 0
+    assert prompts(corpus) == sorted(r["prompt"] for r in current)
+
+
+def test_stale_shards_are_rebuilt(tmp_path):
+    corpus = ShardedCorpus(str(tmp_path / "shards"), shard_size=4, workers=1)
+    corpus.update([record(i) for i in range(8)])
+
+    # Three of the second shard's four records are gone: its live record moves to a new shard
+    current = [record(i) for i in range(5)]
+    report = corpus.update(current)
+    assert (report["removed_shards"], report["converted"], report["shards"]) == (1, 1, 2)
+    assert prompts(corpus) == sorted(r["prompt"] for r in current)
+    assert sorted(p.name for p in (tmp_path / "shards").glob("*.spacy")) == ["shard-00000.spacy", "shard-00002.spacy"]
+
+
+def test_misaligned_entities_are_counted(tmp_path):
+    corpus = ShardedCorpus(str(tmp_path / "shards"), shard_size=4, workers=1)
+    bad = {"prompt": "Send 50 ETH to Bob", "entities": [{"start": 5, "end": 6, "label": "AMOUNT"}]}
+    assert corpus.update([record(1), bad])["misaligned"] == 1
+
+
+def test_shards_of_an_older_manifest_are_deleted(tmp_path):
+    shard_dir = tmp_path / "shards"
+    corpus = ShardedCorpus(str(shard_dir), shard_size=4, workers=1)
+    corpus.update([record(i) for i in range(12)])
+    manifest = json.loads((shard_dir / "manifest.json").read_text())
+    (shard_dir / "manifest.json").write_text(json.dumps(dict(manifest, version=1)))
+
+    report = corpus.update([record(i) for i in range(4)])
+    assert (report["converted"], report["shards"]) == (4, 1)
+    assert sorted(p.name for p in shard_dir.iterdir()) == ["manifest.json", "shard-00000.spacy", "shard-00000.spacy.hashes"]
+    assert prompts(corpus) == sorted(record(i)["prompt"] for i in range(4))
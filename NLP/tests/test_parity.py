@@ -0,0 +1,78 @@
+"""
+The fast path and the skeleton cache must answer exactly as the pipeline does
+
+Every prompt of train_data.json and of the canonical grammar is replayed
+through each shortcut and compared with parse_prompt, as
+`python benchmark.py fastpath` does for the fast path.
+"""
+
+import pytest
+
+from benchmark import canonical_prompts, load_prompts
+from fast_parser import FastParser
+from prompt_cache import normalize_prompt
+from skeleton_cache import SkeletonCache
+
+ADDRESS = "0x90889C14149Bf930B6824789431B8479aaB8e5ee"
+
+# (prompt with distinct slot values, the same skeleton with a value repeated). The pipeline
+# merges or reuses repeated values, so the template learned from the first must not answer the second.
+REPEATED_VALUE_PAIRS = [
+    ("Send 5 ETH and 6 ETH to Bob", "Send 5 ETH and 5 ETH to Bob"),
+    ("Send 5 ETH and 6 ETH to Bob", "Send 5 ETH and 5.0 ETH to Bob"),
+    ("Send 1 ETH to Bob, then send 2 ETH to Alice", "Send 1 ETH to Bob, then send 2 ETH to bob"),
+    ("Send 1 USDC to Bob on Base, then swap 2 USDC for ETH on Base",
+     "Send 1 USDC to Bob on Base, then swap 1 USDC for ETH on Base"),
+    (f"Send 1 ETH to {ADDRESS}, then send 2 ETH to 0x" + "1" * 40,
+     f"Send 1 ETH to {ADDRESS}, then send 2 ETH to {ADDRESS}"),
+]
+
+
+def all_prompts():
+    prompts = load_prompts() + canonical_prompts() + [prompt for pair in REPEATED_VALUE_PAIRS for prompt in pair]
+    return list(dict.fromkeys(normalize_prompt(prompt) for prompt in prompts))
+
+
+@pytest.fixture(scope="module")
+def expected(service):
+    return {prompt: service.parse_prompt(service.nlp, prompt) for prompt in all_prompts()}
+
+
+def test_fast_path_matches_pipeline(service, expected):
+    fast_parser = FastParser(service.nlp.tokenizer.rules)
+    mismatches = []
+    for prompt, full in expected.items():
+        fast = fast_parser.parse(prompt)
+        if fast is not None and fast != full:
+            mismatches.append(prompt)
+    assert fast_parser.hits > 0
+    assert mismatches == []
+
+
+def test_skeleton_cache_matches_pipeline(service, expected):
+    cache = SkeletonCache(service.copy_tokenizer(service.nlp))
+    mismatches = []
+    # Learn in the first pass, as the service does after each pipeline parse, then answer from the templates
+    for _ in range(2):
+        for prompt, full in expected.items():
+            cached = cache.lookup(prompt)
+            if cached is not None:
+                if cached != full:
+                    mismatches.append(prompt)
+                continue
+            probe = cache.probe_for(prompt)
+            if probe is not None:
+                cache.learn(prompt, full, service.parse_prompt(service.nlp, probe))
+    assert cache.stats()["hits"] > 0
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("distinct, repeated", REPEATED_VALUE_PAIRS)
+def test_repeated_values_bypass_skeleton_cache(service, expected, distinct, repeated):
+    cache = SkeletonCache(service.copy_tokenizer(service.nlp))
+    distinct, repeated = normalize_prompt(distinct), normalize_prompt(repeated)
+    probe = cache.probe_for(distinct)
+    assert cache.learn(distinct, expected[distinct], service.parse_prompt(service.nlp, probe))
+    assert cache.split(repeated)[0] == cache.split(distinct)[0]
+    assert cache.lookup(distinct) == expected[distinct]
+    assert cache.lookup(repeated) is None
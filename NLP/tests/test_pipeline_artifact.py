@@ -0,0 +1,27 @@
+import copy
+
+import pipeline_artifact
+
+
+def test_artifact_key_follows_the_component_version_and_patterns(service, monkeypatch):
+    key = service.pipeline_artifact_key("digest")
+    assert service.pipeline_artifact_key("digest") == key
+    assert service.pipeline_artifact_key("other digest") != key
+
+    monkeypatch.setattr(service, "COMPONENT_VERSION", service.COMPONENT_VERSION + 1)
+    assert service.pipeline_artifact_key("digest") != key
+    monkeypatch.undo()
+
+    patterns = copy.deepcopy(service.INTENT_PARAMETER_PATTERNS)
+    patterns["INTENT_SWAP"] = patterns["INTENT_SWAP"] + [[{"LOWER": "exchange"}]]
+    monkeypatch.setattr(service, "INTENT_PARAMETER_PATTERNS", patterns)
+    assert service.pipeline_artifact_key("digest") != key
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "pipeline.pkl")
+    pipeline_artifact.save(path, {"pipeline": [1, 2]}, "key", {"created": "now"})
+    info, pipeline, payload = pipeline_artifact.load(path, "key")
+    assert (info["created"], pipeline) == ("now", {"pipeline": [1, 2]})
+    assert pipeline_artifact.load(path, "other key") is None
+    assert pipeline_artifact.load(str(tmp_path / "missing.pkl"), "key") is None
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def test_calls_beyond_the_queue_are_rejected(service):
+    pool = service.PipelinePool(["pipeline"], queue_size=1)
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(pool.run(lambda pipeline: release.wait(5)))
+        waiting = asyncio.ensure_future(pool.run(lambda pipeline: pipeline))
+        await asyncio.sleep(0)
+        assert pool.pending == 2
+        with pytest.raises(service.PoolOverloaded):
+            await pool.run(lambda pipeline: pipeline)
+        release.set()
+        assert await running is True
+        assert await waiting == "pipeline"
+        assert pool.pending == 0
+        assert await pool.run(lambda pipeline: pipeline) == "pipeline"
+
+    asyncio.run(main())
+    assert pool.rejected == 1
+    pool.executor.shutdown()
+
+
+def test_full_pool_returns_503(service, monkeypatch):
+    monkeypatch.setattr(service.pipeline_pool, "max_pending", 0)
+    client = TestClient(service.app)
+    # Neither cached nor handled by the fast path or a skeleton template, so it needs the pipeline
+    prompt = "please bridge some ETH over to Base when gas is low"
+    response = client.post("/process_prompt", json={"prompt": prompt})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    response = client.post("/process_prompts", json={"prompts": [prompt]})
+    assert response.status_code == 503
+
+    monkeypatch.undo()
+    assert client.post("/process_prompt", json={"prompt": prompt}).status_code == 200
@@ -0,0 +1,51 @@
+from prompt_cache import PromptCache, normalize_prompt
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Send 5   ETH\tto Bob \n") == "Send 5 ETH to Bob"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PromptCache(max_size=2)
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}
+    cache.put("c", {"n": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+    assert cache.get("c") == {"n": 3}
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 3, 1, 1)
+
+
+def test_get_returns_a_copy():
+    cache = PromptCache()
+    cache.put("a", {"tokens": []})
+    cache.get("a")["tokens"].append("ETH")
+    assert cache.get("a") == {"tokens": []}
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("prompt_cache.time.monotonic", lambda: now[0])
+    cache = PromptCache(ttl=10)
+    cache.put("a", {"n": 1})
+    now[0] += 5
+    assert cache.get("a") == {"n": 1}
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_versions_do_not_share_entries():
+    cache = PromptCache(version="model-1")
+    cache.put("a", {"n": 1})
+    cache.version = "model-2"
+    assert cache.get("a") is None
+
+
+def test_size_zero_disables_the_cache():
+    cache = PromptCache(max_size=0)
+    cache.put("a", {"n": 1})
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
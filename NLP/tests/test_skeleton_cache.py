@@ -0,0 +1,38 @@
+from prompt_cache import normalize_prompt
+from skeleton_cache import SkeletonCache, has_repeats
+
+
+def learned_cache(service, parse, prompt):
+    cache = SkeletonCache(service.copy_tokenizer(service.nlp))
+    prompt = normalize_prompt(prompt)
+    probe = cache.probe_for(prompt)
+    assert probe is not None
+    assert cache.learn(prompt, parse(prompt), parse(probe))
+    return cache
+
+
+def test_template_fills_prompts_with_distinct_values(service, parse):
+    cache = learned_cache(service, parse, "Send 5 ETH and 6 ETH to Bob")
+    prompt = normalize_prompt("Send 7 ETH and 8 ETH to Alice")
+    assert cache.lookup(prompt) == parse(prompt)
+
+
+def test_repeated_amount_goes_to_the_pipeline(service, parse):
+    # The pipeline merges the duplicate (amount, token) pair; the template learned
+    # from distinct values would return two token entries
+    cache = learned_cache(service, parse, "Send 5 ETH and 6 ETH to Bob")
+    prompt = normalize_prompt("Send 5 ETH and 5 ETH to Bob")
+    assert cache.lookup(prompt) is None
+    assert len(parse(prompt)["result"]["parameters"]["tokens"]) == 1
+
+
+def test_prompt_with_repeated_values_is_not_learned(service):
+    cache = SkeletonCache(service.copy_tokenizer(service.nlp))
+    assert cache.probe_for(normalize_prompt("Send 5 ETH and 5.0 ETH to Bob")) is None
+    assert cache.stats()["pending"] == 0
+
+
+def test_has_repeats():
+    assert has_repeats([("<NUM>", "5"), ("<NUM>", "5.0")])
+    assert has_repeats([("<NAME>", "Bob"), ("<NAME>", "bob")])
+    assert not has_repeats([("<NUM>", "5"), ("<NUM>", "6"), ("<NAME>", "Bob")])
@@ -0,0 +1,87 @@
+import io
+import json
+import logging
+import os
+
+import pytest
+
+import structured_log
+from structured_log import setup_logging
+
+
+@pytest.fixture
+def restore_logging():
+    """Put back the root handlers and the running listener after the test"""
+    root = logging.getLogger()
+    handlers, level, previous = list(root.handlers), root.level, structured_log.listener
+    yield
+    structured_log.stop_listener()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    structured_log.listener = previous
+    if previous is not None:
+        previous.start()
+
+
+def lines(handler, stream):
+    handler.listener.stop()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_written_as_json_lines(restore_logging):
+    stream = io.StringIO()
+    handler = setup_logging("INFO", "json", stream=stream)
+    logging.getLogger("test").info("Parsed %d prompts", 3, extra={"fields": {"ms": 1.5}})
+    [entry] = lines(handler, stream)
+    assert (entry["logger"], entry["message"], entry["ms"]) == ("test", "Parsed 3 prompts", 1.5)
+
+
+def test_setup_logging_twice_stops_the_first_listener(restore_logging):
+    first = setup_logging("INFO", "json", stream=io.StringIO())
+    stream = io.StringIO()
+    second = setup_logging("INFO", "json", stream=stream)
+    assert not first.listener.running
+    first.listener.stop()
+    logging.getLogger("test").info("after")
+    assert [entry["message"] for entry in lines(second, stream)] == ["after"]
+    second.listener.stop()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork()")
+def test_fork_with_a_stopped_listener(restore_logging):
+    handler = setup_logging("INFO", "json", stream=io.StringIO())
+    handler.listener.stop()
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+    assert not handler.listener.running
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork()")
+def test_listener_runs_again_after_a_fork(restore_logging):
+    stream = io.StringIO()
+    handler = setup_logging("INFO", "json", stream=stream)
+    logging.getLogger("test").info("before")
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if handler.listener.running else 1)
+    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+    assert handler.listener.running
+    logging.getLogger("test").info("after")
+    assert [entry["message"] for entry in lines(handler, stream)] == ["before", "after"]
+
+
+def test_other_handlers_see_the_original_record(restore_logging, caplog):
+    setup_logging("INFO", "json", stream=io.StringIO())
+    logging.getLogger().addHandler(caplog.handler)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("test").exception("Failed %s", "here")
+    [record] = [r for r in caplog.records if r.name == "test"]
+    assert record.exc_info is not None
+    assert (record.msg, record.args) == ("Failed %s", ("here",))
@@ -0,0 +1,42 @@
+from sweep import choose, pareto_front, promote
+
+
+def variant(name, ents_f, p50_ms, size_mb):
+    return {"name": name, "ents_f": ents_f, "p50_ms": p50_ms, "size_mb": size_mb}
+
+
+RESULTS = [
+    variant("small", 0.90, 0.2, 1.0),
+    variant("medium", 0.95, 0.4, 2.0),
+    variant("large", 0.97, 0.8, 4.0),
+    variant("slow-small", 0.90, 0.3, 1.0),
+    variant("worse-large", 0.94, 0.9, 5.0),
+]
+
+
+def test_pareto_front():
+    front = {r["name"] for r in pareto_front([dict(r) for r in RESULTS]) if r["pareto"]}
+    assert front == {"small", "medium", "large"}
+
+
+def test_choose_within_latency_budget():
+    assert choose(RESULTS)["name"] == "large"
+    assert choose(RESULTS, latency_budget_ms=0.5)["name"] == "medium"
+    assert choose(RESULTS, latency_budget_ms=0.1) is None
+
+
+def test_choose_prefers_the_faster_variant_on_a_tie():
+    assert choose(RESULTS, latency_budget_ms=0.3)["name"] == "small"
+
+
+def test_promote_keeps_the_previous_model(tmp_path):
+    target = tmp_path / "model-best"
+    old, new = tmp_path / "old", tmp_path / "new"
+    for path, text in ((old, "old"), (new, "new")):
+        path.mkdir()
+        (path / "meta.json").write_text(text)
+    promote(str(old), str(target))
+    promote(str(new), str(target))
+    assert (target / "meta.json").read_text() == "new"
+    assert (tmp_path / "model-best.prev" / "meta.json").read_text() == "old"
+    assert not (tmp_path / "model-best.tmp").exists()
@@ -0,0 +1,41 @@
+import json
+
+from tracing import SlowLog, Trace
+
+
+def trace(name="/process_prompt"):
+    trace = Trace(name)
+    trace.add("lookup", trace.started, trace.started + 0.001)
+    trace.finish()
+    return trace.events(1, 1)
+
+
+def test_slow_log_is_valid_json_after_every_write(tmp_path):
+    path = tmp_path / "slow.trace.json"
+    slow_log = SlowLog(str(path))
+    slow_log.write([trace()])
+    assert len(json.loads(path.read_text())) == 2
+    slow_log.write([trace(), trace("/batch")])
+    events = json.loads(path.read_text())
+    assert len(events) == 6
+    assert events[-2]["name"] == "/batch"
+
+
+def test_slow_log_rotates_by_size(tmp_path):
+    path = tmp_path / "slow.trace.json"
+    slow_log = SlowLog(str(path), max_bytes=1000)
+    for _ in range(20):
+        slow_log.write([trace()])
+    assert path.stat().st_size <= 1000
+    rotated = tmp_path / "slow.trace.json.1"
+    assert rotated.stat().st_size <= 1000
+    assert json.loads(path.read_text()) and json.loads(rotated.read_text())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["slow.trace.json", "slow.trace.json.1"]
+
+
+def test_unterminated_file_is_rotated(tmp_path):
+    path = tmp_path / "slow.trace.json"
+    path.write_text('[\n{"name":"old"},\n')
+    SlowLog(str(path)).write([trace()])
+    assert len(json.loads(path.read_text())) == 2
+    assert (tmp_path / "slow.trace.json.1").read_text() == '[\n{"name":"old"},\n'
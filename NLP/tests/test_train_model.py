@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+import train_model
+from train_model import BASE_MODEL_PATH
+
+
+@pytest.fixture
+def finetune_setup(tmp_path, monkeypatch):
+    """A fresh output dir, shards in tmp_path and a dev score that only gets worse after the base model's"""
+    monkeypatch.setattr(train_model, "SHARD_DIR", str(tmp_path / "shards"))
+    new_path = tmp_path / "new.jsonl"
+    with open(train_model.TRAIN_DATA_PATH) as f:
+        records = json.load(f)[:3]
+    new_path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    scores = iter([0.5, 0.4, 0.3])
+    monkeypatch.setattr(train_model, "evaluate",
+                        lambda nlp, examples: {"ents_f": next(scores, 0.5), "ents_p": 0.5, "ents_r": 0.5})
+    return tmp_path / "out", str(new_path)
+
+
+def test_finetune_without_improvement_keeps_the_base_model(finetune_setup):
+    output_dir, new_path = finetune_setup
+    report = train_model.train_model("finetune", str(output_dir), new_path=new_path, max_epochs=2, patience=1,
+                                     rehearsal=1.0)
+    assert report["best_epoch"] == 0
+    assert report["best_model"] == BASE_MODEL_PATH
+    assert not (output_dir / "model-best").exists()
+    assert (output_dir / "model-last").is_dir()
+    assert not (output_dir / "checkpoint").exists()
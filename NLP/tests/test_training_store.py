@@ -0,0 +1,68 @@
+import json
+
+from training_store import TrainingLog, compact, export, load_dataset
+
+RECORD = {"prompt": "Send 5 ETH to Bob", "entities": [{"start": 5, "end": 6, "label": "AMOUNT"}]}
+
+
+def record(i):
+    return dict(RECORD, prompt=f"Send {i} ETH to Bob")
+
+
+def test_append_and_read(tmp_path):
+    log = TrainingLog(str(tmp_path / "log.jsonl"))
+    assert list(log.read()) == []
+    log.append(record(0))
+    log.append_many([record(1), record(2)], fsync=True)
+    assert list(log.read()) == [record(0), record(1), record(2)]
+    assert len(log) == 3
+
+
+def test_torn_final_line_is_skipped(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = TrainingLog(str(path))
+    log.append_many([record(0), record(1)])
+    path.write_bytes(path.read_bytes()[:-10])
+    assert list(log.read()) == [record(0)]
+
+
+def test_append_after_a_torn_line(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = TrainingLog(str(path))
+    log.append_many([record(0), record(1)])
+    path.write_bytes(path.read_bytes()[:-10])
+    log.append(record(2))
+    assert list(log.read()) == [record(0), record(2)]
+
+    dataset = tmp_path / "train_data.json"
+    assert compact(log, str(dataset)) == 2
+    assert load_dataset(str(dataset)) == [record(0), record(2)]
+
+
+def test_unreadable_line_is_skipped(tmp_path, caplog):
+    path = tmp_path / "log.jsonl"
+    path.write_text(json.dumps(record(0)) + "\n" + '{"prompt": "Send{"prompt": "x"}\n' + json.dumps(record(1)) + "\n")
+    assert list(TrainingLog(str(path)).read()) == [record(0), record(1)]
+    assert "log.jsonl:2" in caplog.text
+
+
+def test_compact_moves_the_log_into_the_dataset(tmp_path):
+    dataset = tmp_path / "train_data.json"
+    dataset.write_text(json.dumps([record(0)]))
+    log = TrainingLog(str(tmp_path / "log.jsonl"))
+    log.append_many([record(1), record(2)])
+    assert compact(log, str(dataset)) == 2
+    assert load_dataset(str(dataset)) == [record(0), record(1), record(2)]
+    assert list(log.read()) == []
+    assert compact(log, str(dataset)) == 0
+
+
+def test_export_keeps_the_log(tmp_path):
+    dataset = tmp_path / "train_data.json"
+    output = tmp_path / "merged.json"
+    log = TrainingLog(str(tmp_path / "log.jsonl"))
+    log.append(record(1))
+    assert export(log, str(dataset), str(output)) == 1
+    assert load_dataset(str(output)) == [record(1)]
+    assert not dataset.exists()
+    assert len(log) == 1
@@ -0,0 +1,170 @@
+"""
+Per-request trace spans and a slow-request log in the Chrome trace event format
+
+The slow log is a JSON array of trace events that stays closed: each write
+replaces the final "]" with the new events and a new "]", so the file always
+loads as JSON. Open it in https://ui.perfetto.dev or chrome://tracing; each
+slow request is drawn on its own track, with its stages nested underneath.
+Once the file would grow past max_bytes it is renamed to <path>.1, replacing
+the previous one, and a new array is started.
+"""
+
+import fcntl
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How every slow log ends; a write overwrites it in place
+ARRAY_END = b"\n]\n"
+
+
+class Trace:
+    """Timed spans of one request, as perf_counter start/end pairs, plus attributes"""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.finished = None
+        # When the handler produced its result; the time after it is spent on the response
+        self.returned = None
+        self.spans = []
+        self.args = {}
+
+    def add(self, name, start, end, **args):
+        self.spans.append((name, start, end, args))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        if self.returned is not None:
+            self.add("response", self.returned, self.finished)
+
+    @property
+    def duration(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def events(self, pid, tid):
+        """Chrome trace "complete" events: the request, then its spans"""
+        def us(t):
+            return round((self.wall + t - self.started) * 1e6, 1)
+
+        events = [{"name": self.name, "cat": "request", "ph": "X", "ts": us(self.started),
+                   "dur": round(self.duration * 1e6, 1), "pid": pid, "tid": tid, "args": self.args}]
+        for name, start, end, args in self.spans:
+            event = {"name": name, "cat": "stage", "ph": "X", "ts": us(start), "dur": round((end - start) * 1e6, 1),
+                     "pid": pid, "tid": tid}
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def stages(self):
+        """Milliseconds per span name, summed over repeated spans"""
+        totals = {}
+        for name, start, end, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + end - start
+        return {name: round(1000 * total, 3) for name, total in totals.items()}
+
+
+class SlowLog:
+    """Appends the traces of requests slower than threshold_ms to a trace event file.
+
+    Traces are written by a background thread, so recording never blocks the
+    request; if the writer falls max_queue traces behind, further traces are
+    dropped and counted. The file and its one rotated copy hold at most about
+    max_bytes each.
+    """
+
+    def __init__(self, path, threshold_ms=100, max_queue=1000, max_bytes=20 * 2**20):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, trace):
+        """Queue trace for writing if it was slow; returns True if it was"""
+        if not self.enabled or trace.duration < self.threshold:
+            return False
+        self.start()
+        events = trace.events(os.getpid(), next(self.ids))
+        try:
+            self.queue.put_nowait(events)
+        except queue.Full:
+            self.dropped += 1
+            return True
+        self.recorded += 1
+        return True
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="slow-log", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def open_locked(self):
+        """Open and lock the current file, again if another process rotated it while this one waited"""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def write(self, batch):
+        data = ",\n".join(json.dumps(event, separators=(",", ":")) for events in batch for event in events)
+        data = data.encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Other worker processes may share the file, so the size and the end are read under the lock
+            fd = self.open_locked()
+            try:
+                size = os.fstat(fd).st_size
+                # Rotate a file this write would take past max_bytes, and one that does not end in ARRAY_END
+                # (an interrupted write, or the older unclosed format)
+                if size and (size + len(data) + 2 > self.max_bytes
+                             or os.pread(fd, len(ARRAY_END), max(0, size - len(ARRAY_END))) != ARRAY_END):
+                    os.replace(self.path, self.path + ".1")
+                    os.close(fd)
+                    fd = self.open_locked()
+                    size = os.fstat(fd).st_size
+                if size:
+                    offset, data = size - len(ARRAY_END), b",\n" + data + ARRAY_END
+                else:
+                    offset, data = 0, b"[\n" + data + ARRAY_END
+                written = os.pwrite(fd, data, offset)
+                while written < len(data):
+                    written += os.pwrite(fd, data[written:], offset + written)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.failed += len(batch)
+            logger.error("Failed to write %d slow request traces to %s: %s", len(batch), self.path, str(e))
@@ -1,66 +1,115 @@
 import spacy
 from spacy.training.example import Example
 from spacy.tokens import DocBin
+from spacy.util import compounding, fix_random_seed, minibatch
+from corpus import ShardedCorpus, iter_records, make_doc
+from training_store import DEFAULT_LOG_PATH, load_dataset
+import argparse
+import itertools
 import json
 import random
 import os
+import shutil
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+TRAIN_DATA_PATH = os.path.join(current_dir, "train_data.json")
+SHARD_DIR = os.path.join(current_dir, "train_shards")
+DEV_PATH = os.path.join(current_dir, "valid.spacy")
+MODEL_DIR = os.path.join(current_dir, "model")
+BASE_MODEL_PATH = os.path.join(MODEL_DIR, "model-best")
+
+# Corpora up to this many docs are turned into Examples once and kept in memory;
+# larger ones are streamed from the shards every epoch
+CACHE_LIMIT = 50000
+SHUFFLE_BUFFER = 10000
+
+LABELS = ["INTENT", "AMOUNT", "TOKEN", "RECIPIENT", "ADDRESS", "SOURCE_NETWORK", "DEST_NETWORK", "TOKEN2", "QUERY_TYPE", "BRIDGE_KEYWORD"]
 
 def convert_to_spacy(input_file, output_file):
+    """Write every record of input_file to a single DocBin (see corpus.py for incremental conversion)"""
     nlp = spacy.blank("en")  # Create a blank English model
     db = DocBin()  # Store training data in binary format
-    
-    with open(input_file, "r") as f:
-        data = json.load(f)
-    
-    for item in data:
-        text = item["prompt"]
-        entities = item["entities"]
-        doc = nlp.make_doc(text)
-        ents = []
-        
-        for ent in entities:
-            start = ent["start"]
-            end = ent["end"]
-            label = ent["label"]
-            span = doc.char_span(start, end, label=label)
-            if span is not None:  # Only add valid spans
-                ents.append(span)
-        
-        doc.ents = ents
-        annotations = {"entities": [(ent.start_char, ent.end_char, ent.label_) for ent in ents]}
-        example = Example.from_dict(doc, annotations)
-        
-        # Add the Doc object (example.reference) to DocBin, not the Example object
-        db.add(example.reference)
-    
+    for item in load_dataset(input_file):
+        doc, _ = make_doc(nlp, item)
+        db.add(doc)
     db.to_disk(output_file)
 
-def train_model():
-    # Convert training data to spaCy format
-    convert_to_spacy("/home/oxunavailable/HAi Wallet/NLP/train_data.json", "/home/oxunavailable/HAi Wallet/NLP/train.spacy")
-    
-    # Load a blank model
+# spaCy's default NER architecture, which model/model-best was trained with
+DEFAULT_ARCHITECTURE = {"width": 96, "depth": 4, "embed_size": 2000, "hidden_width": 64}
+
+def ner_config(width=96, depth=4, embed_size=2000, hidden_width=64):
+    """NER component config with the given HashEmbedCNN and parser sizes"""
+    return {"model": {
+        "@architectures": "spacy.TransitionBasedParser.v2",
+        "state_type": "ner",
+        "extra_state_tokens": False,
+        "hidden_width": hidden_width,
+        "maxout_pieces": 2,
+        "use_upper": True,
+        "nO": None,
+        "tok2vec": {
+            "@architectures": "spacy.HashEmbedCNN.v2",
+            "pretrained_vectors": None,
+            "width": width,
+            "depth": depth,
+            "embed_size": embed_size,
+            "window_size": 1,
+            "maxout_pieces": 3,
+            "subword_features": True,
+        },
+    }}
+
+def make_nlp(architecture=None):
+    """Blank English pipeline with an NER component and our labels"""
     nlp = spacy.blank("en")
-    
-    # Add NER pipeline
-    if "ner" not in nlp.pipe_names:
-        ner = nlp.add_pipe("ner")
-    else:
-        ner = nlp.get_pipe("ner")
-    
-    # Add labels to NER
-    labels = ["INTENT", "AMOUNT", "TOKEN", "RECIPIENT", "ADDRESS", "SOURCE_NETWORK", "DEST_NETWORK", "TOKEN2", "QUERY_TYPE", "BRIDGE_KEYWORD"]
-    for label in labels:
+    ner = nlp.add_pipe("ner", config=ner_config(**(architecture or DEFAULT_ARCHITECTURE)))
+    for label in LABELS:
         ner.add_label(label)
-    
+    return nlp
+
+def make_examples(nlp, docs):
+    """Examples pairing an unannotated copy of each doc with its gold annotations"""
+    return [Example(nlp.make_doc(doc.text), doc) for doc in docs]
+
+def load_examples(nlp, path):
+    return make_examples(nlp, DocBin().from_disk(path).get_docs(nlp.vocab))
+
+def training_examples(nlp, corpus, cache_limit=CACHE_LIMIT, buffer_size=SHUFFLE_BUFFER):
+    """Return a function that yields one epoch of training Examples in random order.
+
+    A corpus of up to cache_limit docs is turned into Examples once and
+    shuffled in memory each epoch. A larger one is streamed from its shards
+    through a shuffle buffer of buffer_size docs and each Example is built
+    when it is needed, so memory does not grow with the corpus.
+    """
+    if len(corpus) <= cache_limit:
+        examples = make_examples(nlp, corpus.docs(nlp.vocab))
+
+        def epoch():
+            random.shuffle(examples)
+            return iter(examples)
+    else:
+        def epoch():
+            for doc in corpus.shuffled_docs(nlp.vocab, buffer_size):
+                yield Example(nlp.make_doc(doc.text), doc)
+    return epoch
+
+def evaluate(nlp, examples):
+    scores = nlp.evaluate(examples)
+    return {key: round(scores[key] or 0.0, 4) for key in ("ents_f", "ents_p", "ents_r")}
+
+def train_legacy(corpus, output_dir, epochs=20):
+    """The original loop: one nlp.update per example for a fixed number of epochs, saved as model-best"""
+    nlp = make_nlp()
+
     # Load training data
-    db = DocBin().from_disk("/home/oxunavailable/HAi Wallet/NLP/train.spacy")
-    train_data = list(db.get_docs(nlp.vocab))
-    
+    train_data = list(corpus.docs(nlp.vocab))
+
     # Training configuration
     optimizer = nlp.begin_training()
     random.seed(0)
-    for i in range(20):  # Number of epochs
+    for i in range(epochs):  # Number of epochs
         random.shuffle(train_data)
         losses = {}
         for doc in train_data:
@@ -68,13 +117,195 @@ def train_model():
             example = Example.from_dict(doc, {"entities": [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]})
             nlp.update([example], drop=0.5, sgd=optimizer, losses=losses)
         print(f"Iteration {i+1}, Losses: {losses}")
-    
+
     # Save the trained model
-    output_dir = "/home/oxunavailable/HAi Wallet/NLP/model/model-best"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    nlp.to_disk(output_dir)
-    print(f"Model saved to {output_dir}")
+    best_dir = os.path.join(output_dir, "model-best")
+    nlp.to_disk(best_dir)
+    print(f"Model saved to {best_dir}")
+    return {"epochs": epochs, "best_epoch": epochs}
+
+def train_minibatch(corpus, output_dir, max_epochs=100, patience=10, batch_start=4.0, batch_stop=32.0, compound=1.02,
+                    dropout=0.2, seed=0, cache_limit=CACHE_LIMIT, buffer_size=SHUFFLE_BUFFER, architecture=None):
+    """Minibatched training with a compounding batch size and early stopping on dev F-score.
+
+    The batch size grows from batch_start towards batch_stop by a factor of
+    compound per batch. The dev set is scored after every epoch; the best
+    scoring weights are saved as model-best, and training stops once the
+    score has not improved for patience epochs. The final weights are saved
+    as model-last. architecture overrides the NER network sizes (see ner_config).
+    """
+    fix_random_seed(seed)
+    nlp = make_nlp(architecture)
+    dev_examples = load_examples(nlp, DEV_PATH)
+    optimizer = nlp.initialize(lambda: make_examples(nlp, itertools.islice(corpus.docs(nlp.vocab), 1000)))
+    train_epoch = training_examples(nlp, corpus, cache_limit, buffer_size)
+    batch_sizes = compounding(batch_start, batch_stop, compound)
+
+    best_f, best_epoch = -1.0, 0
+    for epoch in range(1, max_epochs + 1):
+        losses = {}
+        for batch in minibatch(train_epoch(), size=batch_sizes):
+            nlp.update(batch, drop=dropout, sgd=optimizer, losses=losses)
+        scores = evaluate(nlp, dev_examples)
+        print(f"Epoch {epoch}, Losses: {losses}, Dev: {scores}")
+        if scores["ents_f"] > best_f:
+            best_f, best_epoch = scores["ents_f"], epoch
+            nlp.to_disk(os.path.join(output_dir, "model-best"))
+        elif epoch - best_epoch >= patience:
+            print(f"No improvement for {patience} epochs, stopping")
+            break
+
+    nlp.to_disk(os.path.join(output_dir, "model-last"))
+    print(f"Models saved to {output_dir} (model-best from epoch {best_epoch})")
+    return {"epochs": epoch, "best_epoch": best_epoch}
+
+def is_annotated(record):
+    """Raw prompts logged by /log_prompt have no entities and no intent yet"""
+    return bool(record["entities"]) or record.get("intent") is not None
+
+def save_checkpoint(nlp, checkpoint_dir, state):
+    """Replace the checkpoint with the current weights and training state"""
+    tmp_dir = checkpoint_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    nlp.to_disk(tmp_dir)
+    with open(os.path.join(tmp_dir, "state.json"), "w") as f:
+        json.dump(state, f)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.rename(tmp_dir, checkpoint_dir)
+
+def train_finetune(corpus, output_dir, new_path=DEFAULT_LOG_PATH, base=BASE_MODEL_PATH, rehearsal=2.0, max_epochs=10,
+                   patience=3, batch_start=4.0, batch_stop=32.0, compound=1.02, dropout=0.2, seed=0, resume=False):
+    """Continue training an existing model on new annotations mixed with a rehearsal sample of the corpus.
+
+    The new annotated records in new_path (the training log by default; raw
+    prompts without annotations are skipped) are trained on every epoch
+    together with rehearsal times as many docs sampled from the corpus, so
+    the model does not forget what it learned from them. The dev set is
+    scored after every epoch, and output_dir/model-best is written only by an
+    epoch that beats the best score so far, starting from the base model's:
+    a run that never improves leaves model-best as it was. Training stops
+    after patience epochs without improvement. The weights and progress are
+    checkpointed to output_dir/checkpoint after every epoch; with resume=True
+    an interrupted run continues from its last checkpoint. Optimizer state is
+    not part of the checkpoint, so a resumed run starts with fresh Adam moments.
+    The report's best_model is output_dir/model-best, or base if no epoch improved.
+    """
+    checkpoint_dir = os.path.join(output_dir, "checkpoint")
+    base_model = base
+    state = {"epoch": 0, "best_f": None, "best_epoch": 0}
+    if resume and os.path.exists(os.path.join(checkpoint_dir, "state.json")):
+        with open(os.path.join(checkpoint_dir, "state.json"), "r") as f:
+            state = json.load(f)
+        base = checkpoint_dir
+        print(f"Resuming from {checkpoint_dir} after epoch {state['epoch']}")
+    if not os.path.exists(base):
+        raise FileNotFoundError(f"No model to fine-tune at {base}")
+
+    fix_random_seed(seed)
+    nlp = spacy.load(base)
+    ner = nlp.get_pipe("ner")
+    records = [record for record in iter_records(new_path) if is_annotated(record)]
+    if not records:
+        raise ValueError(f"No annotated records in {new_path}")
+    new_docs = [make_doc(nlp, record)[0] for record in records]
+    for label in {ent.label_ for doc in new_docs for ent in doc.ents} - set(ner.labels):
+        ner.add_label(label)
+    rehearsal_docs = corpus.sample_docs(nlp.vocab, int(len(new_docs) * rehearsal), random.Random(seed))
+    train_examples = make_examples(nlp, new_docs + rehearsal_docs)
+    dev_examples = load_examples(nlp, DEV_PATH)
+    base_scores = evaluate(nlp, dev_examples)
+    print(f"Fine-tuning {base} (dev: {base_scores}) on {len(new_docs)} new and {len(rehearsal_docs)} rehearsal docs")
+    if state["best_f"] is None:
+        state["best_f"] = base_scores["ents_f"]
+
+    optimizer = nlp.resume_training()
+    batch_sizes = compounding(batch_start, batch_stop, compound)
+    for epoch in range(state["epoch"] + 1, max_epochs + 1):
+        random.Random(seed + epoch).shuffle(train_examples)
+        losses = {}
+        for batch in minibatch(train_examples, size=batch_sizes):
+            nlp.update(batch, drop=dropout, sgd=optimizer, losses=losses)
+        scores = evaluate(nlp, dev_examples)
+        print(f"Epoch {epoch}, Losses: {losses}, Dev: {scores}")
+        state["epoch"] = epoch
+        if scores["ents_f"] > state["best_f"]:
+            state["best_f"], state["best_epoch"] = scores["ents_f"], epoch
+            nlp.to_disk(os.path.join(output_dir, "model-best"))
+        save_checkpoint(nlp, checkpoint_dir, state)
+        if epoch - state["best_epoch"] >= patience:
+            print(f"No improvement for {patience} epochs, stopping")
+            break
+
+    nlp.to_disk(os.path.join(output_dir, "model-last"))
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    if state["best_epoch"]:
+        best_model = os.path.join(output_dir, "model-best")
+        print(f"Models saved to {output_dir} (model-best from epoch {state['best_epoch']})")
+    else:
+        best_model = base_model
+        print(f"No epoch beat the base model's dev F-score, model-best in {output_dir} left unchanged")
+    return {"epochs": state["epoch"], "best_epoch": state["best_epoch"], "best_model": best_model,
+            "new_docs": len(new_docs), "rehearsal_docs": len(rehearsal_docs), "start_ents_f": base_scores["ents_f"]}
+
+def train_model(mode="minibatch", output_dir=MODEL_DIR, **options):
+    """Convert train_data.json, train in the given mode and report wall-clock time and dev scores of model-best"""
+    # Convert new and changed training records to spaCy format
+    corpus = ShardedCorpus(SHARD_DIR)
+    print(f"Converted training data: {json.dumps(corpus.update(TRAIN_DATA_PATH))}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    if mode == "legacy":
+        report = train_legacy(corpus, output_dir, **options)
+    elif mode == "finetune":
+        report = train_finetune(corpus, output_dir, **options)
+    else:
+        report = train_minibatch(corpus, output_dir, **options)
+    report["train_time_s"] = round(time.perf_counter() - started, 2)
+
+    # Fine-tuning that never improved leaves the base model as the best one
+    nlp = spacy.load(report.get("best_model", os.path.join(output_dir, "model-best")))
+    report.update(evaluate(nlp, load_examples(nlp, DEV_PATH)))
+    report["mode"] = mode
+    print(f"Training report: {json.dumps(report)}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the NER model from train_data.json")
+    parser.add_argument("--mode", choices=["minibatch", "finetune", "legacy"], default="minibatch",
+                        help="minibatch: compounding batches with early stopping; finetune: continue training an "
+                             "existing model on new annotations; legacy: the original per-example loop")
+    parser.add_argument("--output-dir", default=MODEL_DIR, help="where model-best (and model-last) are written")
+    parser.add_argument("--max-epochs", type=int, help="default: 100, or 10 for finetune")
+    parser.add_argument("--patience", type=int, help="epochs without dev improvement before stopping (default: 10, or 3 for finetune)")
+    parser.add_argument("--batch-start", type=float, default=4.0)
+    parser.add_argument("--batch-stop", type=float, default=32.0)
+    parser.add_argument("--batch-compound", type=float, default=1.02)
+    parser.add_argument("--dropout", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-limit", type=int, default=CACHE_LIMIT,
+                        help="keep Examples in memory up to this many docs, stream larger corpora")
+    parser.add_argument("--shuffle-buffer", type=int, default=SHUFFLE_BUFFER, help="docs held for shuffling when streaming")
+    parser.add_argument("--new", default=DEFAULT_LOG_PATH, help="finetune: new annotations (JSON Lines or JSON array)")
+    parser.add_argument("--base", default=BASE_MODEL_PATH, help="finetune: model to start from")
+    parser.add_argument("--rehearsal", type=float, default=2.0, help="finetune: corpus docs mixed in per new doc")
+    parser.add_argument("--resume", action="store_true", help="finetune: continue an interrupted run from its checkpoint")
+    args = parser.parse_args()
+
+    if args.mode == "legacy":
+        train_model("legacy", args.output_dir)
+        return
+    options = dict(batch_start=args.batch_start, batch_stop=args.batch_stop, compound=args.batch_compound,
+                   dropout=args.dropout, seed=args.seed)
+    if args.max_epochs is not None:
+        options["max_epochs"] = args.max_epochs
+    if args.patience is not None:
+        options["patience"] = args.patience
+    if args.mode == "finetune":
+        train_model("finetune", args.output_dir, new_path=args.new, base=args.base, rehearsal=args.rehearsal,
+                    resume=args.resume, **options)
+    else:
+        train_model("minibatch", args.output_dir, cache_limit=args.cache_limit, buffer_size=args.shuffle_buffer, **options)
 
 if __name__ == "__main__":
-    train_model()
\ No newline at end of file
+    main()
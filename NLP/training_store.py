@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Append-only store for logged and annotated training prompts
+
+Records are appended to a JSON Lines file under an exclusive file lock, one
+os.write per append, so concurrent writers never interleave or lose records and
+an append costs the same however large the dataset is. Compaction folds the log
+into the train_data.json format that train_model.convert_to_spacy reads.
+
+Usage:
+    python training_store.py compact                     # merge the log into train_data.json and clear it
+    python training_store.py export --output merged.json # write train_data.json + log without clearing
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LOG_PATH = os.path.join(current_dir, "train_data.jsonl")
+DEFAULT_DATASET_PATH = os.path.join(current_dir, "train_data.json")
+
+
+def encode(records):
+    return "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode("utf-8")
+
+
+class TrainingLog:
+    """JSON Lines log of training records with locked, atomic appends"""
+
+    def __init__(self, path=DEFAULT_LOG_PATH):
+        self.path = path
+
+    @contextmanager
+    def locked(self, flags=os.O_RDWR | os.O_APPEND | os.O_CREAT):
+        fd = os.open(self.path, flags, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield fd
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def append(self, record):
+        """Append one record"""
+        self.append_many([record])
+
+    def append_many(self, records, fsync=False):
+        """Append records with a single write; optionally fsync before releasing the lock.
+
+        If a crash left a torn last line, the records start on a new line so
+        only that line is lost.
+        """
+        data = encode(records)
+        if not data:
+            return
+        with self.locked() as fd:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                data = b"\n" + data
+            written = os.write(fd, data)
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            if fsync:
+                os.fsync(fd)
+
+    def read(self):
+        """Yield every complete record in the log; lines torn by a crash are skipped with a warning"""
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line_number, line in enumerate(f, 1):
+                if not line.endswith("\n"):
+                    logger.warning("Skipping incomplete record at %s:%d", self.path, line_number)
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping unreadable record at %s:%d", self.path, line_number)
+                    continue
+                yield record
+
+    def __len__(self):
+        return sum(1 for _ in self.read())
+
+
+class AsyncLogWriter:
+    """Bounded write-behind queue in front of a TrainingLog.
+
+    Request handlers submit records without doing any I/O. A background task
+    writes them in batches of up to batch_size, or whatever has arrived after
+    flush_interval seconds, with one write and one fsync per batch on a worker
+    thread. When the queue is full new records are dropped and counted.
+    """
+
+    def __init__(self, log, max_queue=10000, batch_size=256, flush_interval=0.2):
+        self.log = log
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.loop = None
+        self.queue = None
+        self.task = None
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Start the writer on the running event loop (idempotent)"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+            self.task = None
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._run())
+
+    def submit(self, record):
+        """Queue a record for writing; returns False if the queue is full and it was dropped"""
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            record = await self.queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), remaining) if remaining > 0 else self.queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            await self._write(batch)
+
+    async def _write(self, batch):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.log.append_many, batch, True)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error("Failed to write %d training records to %s: %s", len(batch), self.log.path, str(e))
+
+    async def stop(self):
+        """Flush everything queued so far and stop the writer"""
+        if self.task is None or self.task.done():
+            return
+        await self.queue.put(None)
+        await self.task
+
+    def stats(self):
+        return {
+            "path": self.log.path,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch_size": round(self.written / self.batches, 2) if self.batches else None,
+        }
+
+
+def load_dataset(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def write_dataset(path, data):
+    """Atomically replace path with data in the train_data.json format"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export(log, dataset_path=DEFAULT_DATASET_PATH, output_path=None):
+    """Write dataset_path's records followed by the log's to output_path (default: dataset_path)"""
+    data = load_dataset(dataset_path)
+    data.extend(log.read())
+    write_dataset(output_path or dataset_path, data)
+    return len(data)
+
+
+def compact(log, dataset_path=DEFAULT_DATASET_PATH):
+    """Fold the log into dataset_path and truncate it; appends wait on the lock meanwhile"""
+    with log.locked(os.O_RDWR | os.O_CREAT) as fd:
+        records = list(log.read())
+        if records:
+            data = load_dataset(dataset_path)
+            data.extend(records)
+            write_dataset(dataset_path, data)
+            os.ftruncate(fd, 0)
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["compact", "export"])
+    parser.add_argument("--log", default=os.environ.get("NLP_TRAIN_LOG", DEFAULT_LOG_PATH), help="JSON Lines log")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET_PATH, help="train_data.json to merge into")
+    parser.add_argument("--output", help="export: where to write the merged dataset")
+    args = parser.parse_args()
+
+    log = TrainingLog(args.log)
+    if args.command == "compact":
+        moved = compact(log, args.dataset)
+        print(f"Moved {moved} records from {args.log} into {args.dataset}")
+    else:
+        total = export(log, args.dataset, args.output)
+        print(f"Wrote {total} records to {args.output or args.dataset}")
+
+
+if __name__ == "__main__":
+    main()